@@ -0,0 +1,152 @@
+import time
+import sqlite3
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+from config import ANALYTICS_PATH
+from logging_config import logger
+
+# Сводные счётчики всех серверов хранятся под этим guild_id
+GLOBAL_GUILD = 0
+
+class Analytics:
+    """Постоянная статистика воспроизведения: события в SQLite (WAL) и готовые счётчики в памяти.
+
+    Запись только копит события в буфере; в базу они попадают пачкой в flush(), который вызывается
+    вне цикла событий (asyncio.to_thread). Счётчики обновляются сразу, поэтому !stats и GUI читают
+    их без запросов к базе.
+    """
+    def __init__(self, path: str = ANALYTICS_PATH) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, kind TEXT NOT NULL, url TEXT, "
+            "value REAL, created_at REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "guild_id INTEGER NOT NULL, name TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (guild_id, name))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "guild_id INTEGER NOT NULL, url TEXT NOT NULL, title TEXT, plays INTEGER NOT NULL, "
+            "last_played REAL NOT NULL, PRIMARY KEY (guild_id, url))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS tracks_plays ON tracks(guild_id, plays)")
+        self.counters: Dict[Tuple[int, str], float] = {
+            (guild_id, name): value for guild_id, name, value in self.db.execute("SELECT guild_id, name, value FROM counters")
+        }
+        # Ещё не записанные в базу события и приращения
+        self.pending_events: List[Tuple[int, str, Optional[str], Optional[float], float]] = []
+        self.pending_counters: Dict[Tuple[int, str], float] = {}
+        self.pending_tracks: Dict[Tuple[int, str], Tuple[Optional[str], int, float]] = {}
+
+    def _count(self, guild_id: Optional[int], name: str, delta: float = 1) -> None:
+        for gid in {guild_id or GLOBAL_GUILD, GLOBAL_GUILD}:
+            key = (gid, name)
+            self.counters[key] = self.counters.get(key, 0) + delta
+            self.pending_counters[key] = self.pending_counters.get(key, 0) + delta
+
+    def _event(self, guild_id: Optional[int], kind: str, url: Optional[str], value: Optional[float] = None) -> None:
+        with self.lock:
+            self.pending_events.append((guild_id or GLOBAL_GUILD, kind, url, value, time.time()))
+
+    def record_play(self, guild_id: Optional[int], url: Optional[str], title: str) -> None:
+        with self.lock:
+            self._count(guild_id, "plays")
+            if url:
+                now = time.time()
+                for gid in {guild_id or GLOBAL_GUILD, GLOBAL_GUILD}:
+                    _, plays, _ = self.pending_tracks.get((gid, url), (title, 0, now))
+                    self.pending_tracks[(gid, url)] = (title, plays + 1, now)
+        self._event(guild_id, "play", url)
+
+    def record_finish(self, guild_id: Optional[int], url: Optional[str], listened: float, skipped: bool = False) -> None:
+        with self.lock:
+            self._count(guild_id, "listened", listened)
+            if skipped:
+                self._count(guild_id, "skips")
+        self._event(guild_id, "skip" if skipped else "finish", url, listened)
+
+    def record_download(self, guild_id: Optional[int], url: Optional[str], latency: float) -> None:
+        with self.lock:
+            self._count(guild_id, "downloads")
+            self._count(guild_id, "download_time", latency)
+        self._event(guild_id, "download", url, latency)
+
+    def pending(self) -> int:
+        return len(self.pending_events)
+
+    def _restore(self, events: List[Tuple[int, str, Optional[str], Optional[float], float]],
+                 counters: Dict[Tuple[int, str], float],
+                 tracks: Dict[Tuple[int, str], Tuple[Optional[str], int, float]]) -> None:
+        """Возвращает незаписанное в буферы, перед накопленным за время записи: повтор при следующем flush()."""
+        with self.lock:
+            self.pending_events = events + self.pending_events
+            for key, delta in counters.items():
+                self.pending_counters[key] = self.pending_counters.get(key, 0) + delta
+            for key, (title, plays, last) in tracks.items():
+                newer = self.pending_tracks.get(key)
+                self.pending_tracks[key] = (newer[0], newer[1] + plays, newer[2]) if newer else (title, plays, last)
+
+    def flush(self) -> int:
+        """Записывает накопленное одной транзакцией. Вызывается из потока, не из цикла событий."""
+        with self.lock:
+            events, self.pending_events = self.pending_events, []
+            counters, self.pending_counters = self.pending_counters, {}
+            tracks, self.pending_tracks = self.pending_tracks, {}
+        if not events and not counters and not tracks:
+            return 0
+        try:
+            with self.db_lock:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT INTO events (guild_id, kind, url, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                                    events)
+                self.db.executemany(
+                    "INSERT INTO counters (guild_id, name, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(guild_id, name) DO UPDATE SET value = value + excluded.value",
+                    [(gid, name, delta) for (gid, name), delta in counters.items()])
+                self.db.executemany(
+                    "INSERT INTO tracks (guild_id, url, title, plays, last_played) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(guild_id, url) DO UPDATE SET title = excluded.title, plays = plays + excluded.plays, "
+                    "last_played = excluded.last_played",
+                    [(gid, url, title, plays, last) for (gid, url), (title, plays, last) in tracks.items()])
+                self.db.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error("Ошибка записи статистики", extra={"events": len(events), "error": str(e)})
+            with self.db_lock:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+            self._restore(events, counters, tracks)
+            return 0
+        return len(events)
+
+    def counter(self, name: str, guild_id: Optional[int] = None) -> float:
+        return self.counters.get((guild_id or GLOBAL_GUILD, name), 0)
+
+    def top_tracks(self, limit: int = 10, guild_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Самые часто играемые треки по индексу tracks_plays. Обращается к базе – вызывать вне цикла событий."""
+        if self.pending_tracks:
+            self.flush()  # незаписанные прослушивания должны попасть в рейтинг сразу
+        with self.db_lock:
+            rows = self.db.execute("SELECT url, title, plays, last_played FROM tracks WHERE guild_id = ? "
+                                   "ORDER BY plays DESC LIMIT ?", (guild_id or GLOBAL_GUILD, limit)).fetchall()
+        return [{"url": url, "title": title, "plays": plays, "last_played": last} for url, title, plays, last in rows]
+
+    def get_stats(self, guild_id: Optional[int] = None) -> Dict[str, Any]:
+        downloads = self.counter("downloads", guild_id)
+        return {
+            "plays": int(self.counter("plays", guild_id)),
+            "skips": int(self.counter("skips", guild_id)),
+            "listened_hours": round(self.counter("listened", guild_id) / 3600, 2),
+            "downloads": int(downloads),
+            "avg_download_latency": round(self.counter("download_time", guild_id) / downloads, 3) if downloads else 0.0,
+            "pending": self.pending(),
+        }
+
+# Глобальное хранилище статистики
+analytics = Analytics()
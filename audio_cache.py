@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+from config import CACHE_DIR, MAX_CACHE_SIZE, CACHE_INDEX_PATH, CACHE_EVICTION_POLICY
+from logging_config import logger
+
+# Поля info, которые сохраняются в индексе, чтобы повторное воспроизведение не требовало извлечения
+CACHED_INFO_FIELDS = ("id", "title", "fulltitle", "webpage_url", "thumbnail", "duration", "extractor_key", "ext")
+
+_url_key_memo: Dict[str, Optional[str]] = {}
+
+def make_cache_key(extractor: str, video_id: str) -> str:
+    return f"{extractor.lower()}:{video_id}"
+
+def key_from_info(info: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not info:
+        return None
+    extractor = info.get("extractor_key") or info.get("ie_key") or info.get("extractor")
+    video_id = info.get("id")
+    if not extractor or not video_id:
+        return None
+    return make_cache_key(extractor, video_id)
+
+def key_from_url(url: str) -> Optional[str]:
+    """Определяет ключ кэша по URL без сетевых запросов (только по шаблонам экстракторов yt-dlp)."""
+    if url in _url_key_memo:
+        return _url_key_memo[url]
+    key = None
+    try:
+        from yt_dlp.extractor import gen_extractor_classes
+        for ie in gen_extractor_classes():
+            if ie.ie_key() == "Generic" or not ie.suitable(url):
+                continue
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                key = make_cache_key(ie.ie_key(), video_id)
+            break
+    except Exception as e:
+        logger.debug("Не удалось определить ключ кэша по URL", extra={"url": url, "error": str(e)})
+    if len(_url_key_memo) > 4096:
+        _url_key_memo.clear()
+    _url_key_memo[url] = key
+    return key
+
+class AudioCache:
+    def __init__(self, cache_dir: str, max_cache_size: int, index_path: str, policy: str = "lru") -> None:
+        self.cache_dir = cache_dir
+        self.max_cache_size = max_cache_size
+        self.index_path = index_path
+        self.policy = policy
+        self.lock = threading.Lock()
+        # Счётчики ссылок на файлы, которые сейчас воспроизводятся: такие файлы не удаляются
+        self.pins: Dict[str, int] = {}
+        self.db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, info TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_path ON entries(path)")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(entries)")}
+        if "normalized" not in columns:
+            self.db.execute("ALTER TABLE entries ADD COLUMN normalized INTEGER NOT NULL DEFAULT 0")
+            self.db.execute("ALTER TABLE entries ADD COLUMN loudnorm TEXT")
+        self.total_size: int = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        # Обращения к записям (время и число попаданий) копятся в памяти и пишутся в индекс пачкой в flush():
+        # lookup() вызывается из цикла событий, и запись с fsync на каждое попадание блокировала бы его
+        self.touched: Dict[str, Tuple[float, int]] = {}
+        # Попадания и промахи за время работы (для доли попаданий в метриках)
+        self.lookup_hits: int = 0
+        self.lookup_misses: int = 0
+
+    def lookup(self, key: Optional[str]) -> Optional[Tuple[str, Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """Возвращает (путь, info, loudnorm); loudnorm задан только для нормализованного файла."""
+        if not key:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT path, size, info, normalized, loudnorm FROM entries WHERE key = ?",
+                                  (key,)).fetchone()
+            if not row:
+                self.lookup_misses += 1
+                return None
+            path, size, info, normalized, loudnorm = row
+            if not os.path.exists(path):
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_size -= size
+                self.lookup_misses += 1
+                return None
+            self.lookup_hits += 1
+            self.touched[key] = (time.time(), self.touched.get(key, (0.0, 0))[1] + 1)
+        return path, json.loads(info) if info else {}, (json.loads(loudnorm or "{}") if normalized else None)
+
+    def flush(self) -> None:
+        """Записывает накопленные обращения к записям одной транзакцией."""
+        with self.lock:
+            touched, self.touched = self.touched, {}
+            if not touched:
+                return
+            try:
+                with self.db:
+                    self.db.execute("BEGIN")
+                    self.db.executemany("UPDATE entries SET last_access = ?, hits = hits + ? WHERE key = ?",
+                                        [(atime, hits, key) for key, (atime, hits) in touched.items()])
+            except sqlite3.Error as e:
+                logger.error("Ошибка записи обращений к кэшу", extra={"error": str(e)})
+                self.touched = touched  # под блокировкой новых обращений не было – повторим при следующем flush()
+
+    def put(self, key: Optional[str], path: str, info: Optional[Dict[str, Any]] = None) -> None:
+        if not key or not path or not os.path.exists(path):
+            return
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        stored = {k: info.get(k) for k in CACHED_INFO_FIELDS if info and info.get(k) is not None}
+        with self.lock:
+            old = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.total_size -= old[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, path, size, last_access, hits, info, normalized) "
+                "VALUES (?, ?, ?, ?, COALESCE((SELECT hits FROM entries WHERE key = ?), 0), ?, 0)",
+                (key, path, size, time.time(), key, json.dumps(stored, ensure_ascii=False))
+            )
+            self.total_size += size
+        logger.debug("Трек добавлен в кэш", extra={"key": key, "size": size})
+        self.evict()
+
+    def get_source(self, key: str) -> Optional[Tuple[str, bool]]:
+        with self.lock:
+            row = self.db.execute("SELECT path, normalized FROM entries WHERE key = ?", (key,)).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def set_normalized(self, key: str, norm_path: str, loudnorm: Dict[str, Any]) -> bool:
+        """Заменяет исходный файл записи нормализованным; исходный файл удаляется."""
+        norm_path = os.path.abspath(norm_path)
+        size = os.path.getsize(norm_path)
+        with self.lock:
+            row = self.db.execute("SELECT path, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return False
+            self.db.execute("UPDATE entries SET path = ?, size = ?, normalized = 1, loudnorm = ? WHERE key = ?",
+                            (norm_path, size, json.dumps(loudnorm), key))
+            self.total_size += size - row[1]
+        if self.is_pinned(row[0]):
+            return True  # исходный файл ещё играет – его уберёт remove_orphans
+        try:
+            if row[0] != norm_path and os.path.exists(row[0]):
+                os.remove(row[0])
+        except OSError as e:
+            # Файл может быть ещё открыт FFmpeg (Windows) – его уберёт remove_orphans
+            logger.debug("Исходный файл не удалён после нормализации", extra={"file": row[0], "error": str(e)})
+        return True
+
+    def pin(self, path: Optional[str]) -> None:
+        if not path:
+            return
+        path = os.path.abspath(path)
+        with self.lock:
+            self.pins[path] = self.pins.get(path, 0) + 1
+
+    def unpin(self, path: Optional[str]) -> int:
+        """Снимает одну ссылку с файла и возвращает число оставшихся."""
+        if not path:
+            return 0
+        path = os.path.abspath(path)
+        with self.lock:
+            count = self.pins.get(path, 0) - 1
+            if count > 0:
+                self.pins[path] = count
+            else:
+                self.pins.pop(path, None)
+            return max(count, 0)
+
+    def is_pinned(self, path: str) -> bool:
+        return os.path.abspath(path) in self.pins
+
+    def contains_path(self, path: Optional[str]) -> bool:
+        if not path:
+            return False
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM entries WHERE path = ?", (os.path.abspath(path),)).fetchone() is not None
+
+    def remove(self, key: str) -> bool:
+        with self.lock:
+            row = self.db.execute("SELECT path, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return False
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.total_size -= row[1]
+            self.touched.pop(key, None)
+        try:
+            if os.path.exists(row[0]):
+                os.remove(row[0])
+        except Exception as e:
+            logger.error("Ошибка удаления файла из кэша", extra={"file": row[0], "error": str(e)})
+        return True
+
+    def evict(self) -> int:
+        self.flush()  # порядок вытеснения зависит от времени и числа обращений
+        if self.total_size <= self.max_cache_size:
+            return 0
+        order = "hits ASC, last_access ASC" if self.policy == "lfu" else "last_access ASC"
+        removed = 0
+        with self.lock:
+            victims: List[Tuple[str, str, int]] = self.db.execute(
+                f"SELECT key, path, size FROM entries ORDER BY {order}"
+            ).fetchall()
+        for key, path, size in victims:
+            if self.total_size <= self.max_cache_size:
+                break
+            if self.is_pinned(path):
+                continue
+            if self.remove(key):
+                removed += 1
+        if removed:
+            logger.info("Вытеснено треков из кэша", extra={"count": removed, "policy": self.policy})
+        return removed
+
+    def remove_orphans(self, max_age: float = 3600) -> int:
+        """Удаляет файлы, отсутствующие в индексе (например, брошенные .part), старше max_age секунд."""
+        with self.lock:
+            known = {row[0] for row in self.db.execute("SELECT path FROM entries")}
+        index_files = {os.path.abspath(self.index_path) + suffix for suffix in ("", "-wal", "-shm")}
+        now = time.time()
+        count = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                path = os.path.abspath(entry.path)
+                if not entry.is_file() or path in known or path in index_files or path in self.pins:
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > max_age:
+                        os.remove(entry.path)
+                        count += 1
+                except Exception as e:
+                    logger.error("Ошибка удаления файла из кэша", extra={"file": entry.path, "error": str(e)})
+        return count
+
+    def most_hit(self, limit: int) -> List[Tuple[str, bool]]:
+        """Ключи самых востребованных записей и признак нормализации."""
+        self.flush()
+        with self.lock:
+            rows = self.db.execute("SELECT key, normalized FROM entries ORDER BY hits DESC LIMIT ?", (limit,)).fetchall()
+        return [(key, bool(normalized)) for key, normalized in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM entries").fetchone()
+            pending_hits = sum(hits for _, hits in self.touched.values())
+        lookups = self.lookup_hits + self.lookup_misses
+        return {"entries": entries[0], "hits": entries[1] + pending_hits, "size": self.total_size, "max_size": self.max_cache_size,
+                "hit_rate": round(self.lookup_hits / lookups, 3) if lookups else 0.0}
+
+# Глобальный индекс аудиокэша
+audio_cache = AudioCache(CACHE_DIR, MAX_CACHE_SIZE, CACHE_INDEX_PATH, CACHE_EVICTION_POLICY)
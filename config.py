@@ -11,30 +11,164 @@ FFMPEG_BINARY: str = "ffmpeg"
 CURRENT_VERSION: str = "dev.ver"
 CACHE_DIR: str = "music_cache"
 MAX_CACHE_SIZE: int = 1024 * 1024 * 1024  # 1 ГБ
+CACHE_INDEX_PATH: str = os.path.join(CACHE_DIR, "index.sqlite3")
+CACHE_EVICTION_POLICY: str = "lru"  # "lru" или "lfu"
+
+# Горячий уровень кэша в памяти (tmpfs): копии самых частых треков, FFmpeg читает их без обращений к диску
+HOT_CACHE_ENABLED: bool = True
+HOT_CACHE_DIR: str = "/dev/shm/music_hot" if os.path.isdir("/dev/shm") else ""  # пусто – уровень отключён
+HOT_CACHE_SIZE: int = 256 * 1024 * 1024  # 256 МБ
+HOT_PROMOTE_HITS: int = 3  # открытий трека до переноса в память
 
 # Настройка FFmpeg
 SAMPLE_RATE = 48000
 CHANNELS = 2
-filter_chain_parts = [
-    f"[0:a]aformat=sample_fmts=fltp:sample_rates={SAMPLE_RATE}:channel_layouts=stereo",
-    "loudnorm=I=-16:TP=-1.5:LRA=11",
+LOUDNORM_PARAMS: str = "I=-16:TP=-1.5:LRA=11"
+aformat_filter: str = f"aformat=sample_fmts=fltp:sample_rates={SAMPLE_RATE}:channel_layouts=stereo"
+post_loudnorm_filters = [
     "bass=g=3",
     "dynaudnorm=f=150:g=15",
     "aresample=async=1"
 ]
+filter_chain_parts = [
+    f"[0:a]{aformat_filter}",
+    f"loudnorm={LOUDNORM_PARAMS}",
+    *post_loudnorm_filters
+]
 filter_chain = ", ".join(filter_chain_parts)
 ffmpeg_args = [
     "-vn",
     f'-filter_complex "{filter_chain}"',
+    "-err_detect ignore_err"
+]
+ffmpeg_opts_no_fade: str = " ".join(ffmpeg_args)
+# Файл уже нормализован (см. normalizer.py) – при воспроизведении фильтры не нужны
+ffmpeg_opts_normalized: str = "-vn"
+# Воспроизведение Opus: FFmpeg сам кодирует (или копирует) Opus, бот не декодирует PCM и не перекодирует кадры
+OPUS_PASSTHROUGH: bool = True
+OPUS_BITRATE: int = 128  # кбит/с
+PLAYBACK_VOLUME: float = 0.7  # громкость применяется фильтром FFmpeg, а не PCMVolumeTransformer
+ffmpeg_opts_opus: str = " ".join([
+    "-vn",
+    f'-filter_complex "{filter_chain}, volume={PLAYBACK_VOLUME}"',
+    "-err_detect ignore_err"
+])
+# Переходы между треками внутри одного источника (mixer.py): без паузы между треками, с кроссфейдом по желанию.
+# Кроссфейд смешивает PCM, поэтому при CROSSFADE_SECONDS > 0 треки играют через PCM, а не Opus
+GAPLESS_PLAYBACK: bool = True
+CROSSFADE_SECONDS: float = 0.0
+MIXER_PRELOAD_SECONDS: float = 15.0  # за сколько секунд до конца трека готовить следующий
+PLAYBACK_OPUS: bool = OPUS_PASSTHROUGH and CROSSFADE_SECONDS <= 0
+# Параметры входа для сетевого потока (режим прямого воспроизведения)
+ffmpeg_stream_before_args = [
     "-reconnect 1",
     "-reconnect_streamed 1",
     "-reconnect_at_eof 1",
-    "-reconnect_delay_max 2",
-    "-err_detect ignore_err"
+    "-reconnect_delay_max 2"
 ]
-ffmpeg_opts_no_fade: str = " ".join(ffmpeg_args)
+ffmpeg_stream_before_options: str = " ".join(ffmpeg_stream_before_args)
+# Прямое воспроизведение: FFmpeg читает аудио по URL без записи на диск, кэш заполняется в фоне
+DIRECT_STREAM: bool = True
+DIRECT_STREAM_BACKGROUND_CACHE: bool = True
 ffmpeg_options: dict = {'options': '-vn'}
 
+# Настройки yt-dlp
+ytdl_format_options: dict = {
+    'format': 'bestaudio/best',
+    'outtmpl': f'{CACHE_DIR}/%(id)s.%(ext)s',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'default_search': 'auto',
+    'source_address': '0.0.0.0',
+}
+
+# Плейлисты: записи хранятся заглушками и загружаются фоновым Prefetcher
+PLAYLIST_MAX_ENTRIES: int = 500
+LIST_PAGE_SIZE: int = 25  # сколько треков очереди показывает !list
+ytdl_playlist_options: dict = dict(ytdl_format_options, extract_flat='in_playlist', noplaylist=False, playlistend=PLAYLIST_MAX_ENTRIES)
+
+# Текстовый поиск: плоское извлечение (только метаданные), общий кэш для !play и альтернатив
+SEARCH_RESULTS: int = 10
+SEARCH_CACHE_SIZE: int = 256
+SEARCH_TTL: float = 3600.0
+ytdl_search_options: dict = dict(ytdl_format_options, extract_flat=True)
+
+# Предзагрузка следующих треков очереди (на каждый сервер)
+PREFETCH_DEPTH: int = 2
+PREFETCH_MAX_CONCURRENT: int = 1  # ограничение полосы: одновременных предзагрузок
+PREFETCH_DISK_BUDGET: int = 64 * 1024 * 1024  # 64 МБ
+PREFETCH_BYTES_PER_SECOND: int = 20000  # оценка размера трека (~160 кбит/с)
+
+# Порог буферизации при частичной загрузке: битрейт берётся из выбранного формата или измеряется
+BUFFER_DEFAULT_BITRATE: int = 160  # кбит/с, если yt-dlp не сообщил ни abr/tbr, ни размер
+BUFFER_MIN_SECONDS: float = 2.0  # минимальный запас при раннем старте
+BUFFER_SPEED_MARGIN: float = 1.5  # ранний старт, когда загрузка во столько раз быстрее воспроизведения
+
+# Подстраховка низким качеством: если основная загрузка не продвигается HEDGE_DELAY секунд,
+# параллельно запускается загрузка в низком качестве; играет та, что раньше наберёт буфер
+HEDGE_DELAY: float = 8.0
+HEDGE_TIMEOUT: float = 60.0
+HEDGE_FORMAT: str = 'worstaudio/bestaudio'
+DOWNLOAD_CANCEL_TIMEOUT: float = 1.0  # сколько ждать остановки потока yt-dlp после отмены
+
+# Планировщик загрузок: начальный лимит подстраивается под пропускную способность и долю ошибок
+DOWNLOAD_CONCURRENCY: int = 5
+DOWNLOAD_MIN_CONCURRENCY: int = 1
+DOWNLOAD_MAX_CONCURRENCY: int = 10
+DOWNLOAD_INTERACTIVE_RESERVE: int = 1  # слоты, недоступные предзагрузке и фоновому кэшированию
+DOWNLOAD_ADAPT_WINDOW: int = 10  # завершённых загрузок между пересчётами лимита
+DOWNLOAD_ERROR_THRESHOLD: float = 0.3
+
+# Голосовое соединение: готовность ждём по событию, повторы – с экспоненциальным отступом и разбросом
+VOICE_CONNECT_TIMEOUT: float = 15.0
+VOICE_CONNECT_ATTEMPTS: int = 5
+VOICE_BACKOFF_BASE: float = 0.5
+VOICE_BACKOFF_MAX: float = 8.0
+
+# История воспроизведения: кольцевой буфер на сервер, вытесненные записи – в журнал при HISTORY_SPILL
+HISTORY_SIZE: int = 200
+HISTORY_SPILL: bool = False
+HISTORY_DIR: str = "history"
+
+# Постоянная статистика воспроизведения (analytics.py): события пишутся в базу пачками раз в интервал
+ANALYTICS_PATH: str = "analytics.sqlite3"
+ANALYTICS_FLUSH_INTERVAL: float = 30.0
+
+# Прогрев кэша: в часы затишья самые популярные треки загружаются и нормализуются заранее
+WARMUP_ENABLED: bool = True
+WARMUP_INTERVAL: float = 15 * 60
+WARMUP_TOP_N: int = 50
+WARMUP_CACHE_FILL: float = 0.8  # доля MAX_CACHE_SIZE, выше которой прогрев не загружает
+WARMUP_BYTES_PER_SECOND: int = 512 * 1024  # средняя полоса прогрева
+WARMUP_MAX_PLAYING: int = 1  # затишье: не больше стольких серверов играют и нет загрузок
+
+# Обновление прогресса в сообщении «Сейчас играет»
+PROGRESS_BAR_LENGTH: int = 20
+PROGRESS_MIN_INTERVAL: float = 5.0
+PROGRESS_MAX_INTERVAL: float = 30.0
+PROGRESS_MAX_EDITS_PER_SECOND: float = 5.0  # общий бюджет правок на все серверы
+PROGRESS_SLOW_EDIT: float = 2.0  # правка дольше – discord.py ждал лимит внутри, сервер обновляется реже
+# Лимиты Discord длиннее этого discord.py не пережидает молча, а выбрасывает discord.RateLimited (не меньше 30 с)
+DISCORD_MAX_RATELIMIT_TIMEOUT: float = 30.0
+
+# Пул процессов для extract_info (разбор yt-dlp не конкурирует за GIL с голосом)
+EXTRACTION_USE_PROCESSES: bool = True
+EXTRACTION_WORKERS: int = 2
+EXTRACTION_MAX_PENDING: int = 32
+EXTRACTION_TIMEOUT: float = 60.0
+EXTRACTION_TASKS_PER_WORKER: int = 50
+
+# Кэш метаданных extract_info
+METADATA_CACHE_SIZE: int = 512
+METADATA_TTL: float = 6 * 3600  # название, длительность, обложка
+METADATA_FORMAT_TTL: float = 30 * 60  # подписанные URL форматов истекают быстрее
+
+# Офлайн-нормализация кэша: двухпроходный loudnorm и цепочка фильтров один раз на трек, результат – Opus 48 кГц
+NORMALIZE_CACHE: bool = True
+NORMALIZE_WORKERS: int = 1
+NORMALIZE_BITRATE: str = "128k"
+
 # Intents для Discord
 intents = discord.Intents.default()
 intents.message_content = True
@@ -0,0 +1,173 @@
+import time
+import asyncio
+import itertools
+import contextlib
+from typing import Optional, Dict, Any, List, AsyncIterator
+from config import (DOWNLOAD_CONCURRENCY, DOWNLOAD_MIN_CONCURRENCY, DOWNLOAD_MAX_CONCURRENCY, DOWNLOAD_INTERACTIVE_RESERVE,
+                    DOWNLOAD_ADAPT_WINDOW, DOWNLOAD_ERROR_THRESHOLD)
+from logging_config import logger
+
+# Классы приоритета загрузок: меньше – важнее
+PRIORITY_INTERACTIVE = 0  # !play: пользователь ждёт ответа
+PRIORITY_NEXT_UP = 1  # следующий трек очереди
+PRIORITY_PREFETCH = 2  # предзагрузка впрок
+PRIORITY_BULK = 3  # фоновое заполнение кэша
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NEXT_UP: "next_up",
+                  PRIORITY_PREFETCH: "prefetch", PRIORITY_BULK: "bulk"}
+
+class DownloadRequest:
+    """Заявка на слот загрузки. Приоритет можно повысить, пока заявка ждёт в очереди."""
+    __slots__ = ("priority", "guild_id", "seq", "enqueued_at", "future", "bytes", "started")
+
+    def __init__(self, priority: int = PRIORITY_INTERACTIVE, guild_id: Optional[int] = None) -> None:
+        self.priority = priority
+        self.guild_id = guild_id
+        self.seq: int = 0
+        self.enqueued_at: float = 0.0
+        self.future: Optional[asyncio.Future] = None
+        self.bytes: int = 0
+        self.started: bool = False  # слот выдан (и должен быть возвращён)
+
+    def promote(self, priority: int) -> None:
+        self.priority = min(self.priority, priority)
+
+class DownloadScheduler:
+    """Очередь загрузок с классами приоритета, справедливостью между серверами и адаптивным лимитом.
+
+    Лимит одновременных загрузок меняется по принципу AIMD: растёт на единицу, пока суммарная скорость
+    не падает, и уменьшается вдвое при большой доле ошибок. Часть слотов всегда остаётся за
+    интерактивными запросами и следующими треками, чтобы предзагрузка не задерживала воспроизведение.
+    """
+    def __init__(self, limit: int = DOWNLOAD_CONCURRENCY, min_limit: int = DOWNLOAD_MIN_CONCURRENCY,
+                 max_limit: int = DOWNLOAD_MAX_CONCURRENCY, reserve: int = DOWNLOAD_INTERACTIVE_RESERVE,
+                 window: int = DOWNLOAD_ADAPT_WINDOW, error_threshold: float = DOWNLOAD_ERROR_THRESHOLD) -> None:
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.reserve = reserve
+        self.window = window
+        self.error_threshold = error_threshold
+        self.waiting: List[DownloadRequest] = []
+        self.active: int = 0
+        self.active_by_guild: Dict[Optional[int], int] = {}
+        self._seq = itertools.count()
+        # Окно наблюдений для подстройки лимита
+        self.window_started: float = time.monotonic()
+        self.window_done: int = 0
+        self.window_failed: int = 0
+        self.window_bytes: int = 0
+        self.last_throughput: float = 0.0
+        # Метрики
+        self.completed: int = 0
+        self.failed: int = 0
+        self.wait_total: Dict[int, float] = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.wait_max: Dict[int, float] = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.started: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def _capacity(self, request: DownloadRequest) -> int:
+        if request.priority <= PRIORITY_NEXT_UP:
+            return self.limit
+        return max(1, self.limit - self.reserve)
+
+    def _start(self, request: DownloadRequest) -> None:
+        request.started = True
+        self.active += 1
+        self.active_by_guild[request.guild_id] = self.active_by_guild.get(request.guild_id, 0) + 1
+        waited = time.monotonic() - request.enqueued_at
+        priority = min(max(request.priority, PRIORITY_INTERACTIVE), PRIORITY_BULK)
+        self.started[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    def _dispatch(self) -> None:
+        # Заявки отменённых задач: их future уже отменён, а сами задачи ещё не успели убрать заявку
+        self.waiting = [r for r in self.waiting if not r.future.done()]
+        while self.waiting:
+            candidates = [r for r in self.waiting if self.active < self._capacity(r)]
+            if not candidates:
+                return
+            # Сначала приоритет, затем сервер с наименьшим числом активных загрузок, затем порядок поступления
+            request = min(candidates, key=lambda r: (r.priority, self.active_by_guild.get(r.guild_id, 0), r.seq))
+            self.waiting.remove(request)
+            request.future.set_result(None)
+            self._start(request)
+
+    async def _acquire(self, request: DownloadRequest) -> None:
+        request.seq = next(self._seq)
+        request.enqueued_at = time.monotonic()
+        request.future = asyncio.get_running_loop().create_future()
+        self.waiting.append(request)
+        self._dispatch()
+        if request.future.done():
+            return
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request in self.waiting:
+                self.waiting.remove(request)
+            elif request.started:
+                self._release(request, None)  # слот выдан одновременно с отменой
+            raise
+
+    def _release(self, request: DownloadRequest, ok: Optional[bool]) -> None:
+        self.active -= 1
+        left = self.active_by_guild.get(request.guild_id, 1) - 1
+        if left > 0:
+            self.active_by_guild[request.guild_id] = left
+        else:
+            self.active_by_guild.pop(request.guild_id, None)
+        if ok is not None:
+            self._observe(ok, request.bytes)
+        self._dispatch()
+
+    def _observe(self, ok: bool, size: int) -> None:
+        self.completed += 1
+        self.window_done += 1
+        self.window_bytes += size
+        if not ok:
+            self.failed += 1
+            self.window_failed += 1
+        if self.window_done < self.window:
+            return
+        now = time.monotonic()
+        throughput = self.window_bytes / max(now - self.window_started, 0.001)
+        old_limit = self.limit
+        if self.window_failed / self.window_done > self.error_threshold:
+            self.limit = max(self.min_limit, self.limit // 2)
+        elif throughput >= self.last_throughput * 0.9:
+            self.limit = min(self.max_limit, self.limit + 1)
+        else:
+            self.limit = max(self.min_limit, self.limit - 1)
+        if self.limit != old_limit:
+            logger.info("Лимит загрузок изменён", extra={"limit": self.limit, "throughput": int(throughput),
+                                                          "errors": self.window_failed})
+        self.last_throughput = throughput
+        self.window_started = now
+        self.window_done = self.window_failed = self.window_bytes = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, request: DownloadRequest) -> AsyncIterator[DownloadRequest]:
+        await self._acquire(request)
+        ok: Optional[bool] = False
+        try:
+            yield request
+            ok = True
+        except asyncio.CancelledError:
+            ok = None  # отмена не говорит о пропускной способности
+            raise
+        finally:
+            self._release(request, ok)
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for request in self.waiting:
+            queued[PRIORITY_NAMES.get(request.priority, "bulk")] += 1
+        avg_wait = {name: round(self.wait_total[p] / self.started[p], 3) if self.started[p] else 0.0
+                    for p, name in PRIORITY_NAMES.items()}
+        max_wait = {name: round(self.wait_max[p], 3) for p, name in PRIORITY_NAMES.items()}
+        return {"limit": self.limit, "active": self.active, "queued": queued, "avg_wait": avg_wait,
+                "max_wait": max_wait, "completed": self.completed, "failed": self.failed,
+                "throughput": int(self.last_throughput)}
+
+# Глобальный планировщик загрузок
+download_scheduler = DownloadScheduler()
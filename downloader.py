@@ -1,78 +1,241 @@
 import time
 import asyncio
-import youtube_dl
+import yt_dlp as youtube_dl
 import discord
 import os
-from typing import Optional, Dict, Any, List, Union
-from config import CACHE_DIR, ffmpeg_opts_no_fade, FFMPEG_BINARY, ytdl_format_options
+import glob
+import shlex
+import threading
+import functools
+from typing import Optional, Dict, Any, List, Union, Tuple, Callable
+from config import (CACHE_DIR, ffmpeg_opts_no_fade, ffmpeg_opts_normalized, ffmpeg_opts_opus, ffmpeg_stream_before_options,
+                    FFMPEG_BINARY, ytdl_format_options, DIRECT_STREAM, DIRECT_STREAM_BACKGROUND_CACHE, PLAYBACK_OPUS,
+                    OPUS_BITRATE, PLAYBACK_VOLUME, BUFFER_DEFAULT_BITRATE, BUFFER_MIN_SECONDS, BUFFER_SPEED_MARGIN,
+                    HEDGE_DELAY, HEDGE_TIMEOUT, HEDGE_FORMAT, DOWNLOAD_CANCEL_TIMEOUT)
 from utils import is_valid_url, format_duration
+from audio_cache import audio_cache, key_from_url, key_from_info
+from analytics import analytics
+from hot_cache import hot_tier
+from metadata_cache import extract_info_sync, extract_info_cached
+from normalizer import normalizer
+from search import search_service
+from download_scheduler import download_scheduler, DownloadRequest, PRIORITY_BULK
 from logging_config import logger
 
 class TrackDownloadError(Exception):
     pass
 
-download_semaphore = asyncio.Semaphore(5)
+class DownloadCancelled(TrackDownloadError):
+    pass
+
+class SingleFlight:
+    """Реестр загрузок по ключу кэша: параллельные запросы одного трека получают общую загрузку."""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, "PartialDownloader"] = {}
+        self.coalesced: int = 0
+
+    def claim(self, key: str, downloader: "PartialDownloader") -> "PartialDownloader":
+        """Регистрирует загрузку под ключом или возвращает уже идущую."""
+        with self.lock:
+            owner = self.in_flight.setdefault(key, downloader)
+            if owner is not downloader:
+                self.coalesced += 1
+            return owner
+
+    def release(self, key: Optional[str], downloader: "PartialDownloader") -> None:
+        with self.lock:
+            if key and self.in_flight.get(key) is downloader:
+                del self.in_flight[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self.in_flight), "coalesced": self.coalesced}
+
+downloads = SingleFlight()
 
 class PartialDownloader:
-    def __init__(self, url: str, min_buffer_duration: int = 10) -> None:
+    def __init__(self, url: str, min_buffer_duration: int = 10, request: Optional[DownloadRequest] = None,
+                 low_quality: bool = False) -> None:
         self.url: str = url
         self.min_buffer_duration: int = min_buffer_duration
+        self.request: DownloadRequest = request or DownloadRequest()
+        # Низкое качество – подстраховка: отдельный файл, не попадает в индекс кэша
+        self.low_quality: bool = low_quality
         self.file_path: Optional[str] = None
+        self.tmp_path: Optional[str] = None
         self.info: Optional[Dict[str, Any]] = None
+        self.loudnorm: Optional[Dict[str, Any]] = None
+        self.key: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.users: int = 1
         self.ready_to_play: asyncio.Event = asyncio.Event()
         self.download_finished: asyncio.Event = asyncio.Event()
-        self.approx_bitrate: int = 320
-        self.bytes_per_second: int = (self.approx_bitrate * 1000) // 8
+        self.buffered: bool = False
+        self.loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        # Для ожидания из потока другой загрузки того же трека (asyncio.Event там недоступен)
+        self.finished: threading.Event = threading.Event()
+        # Скорость воспроизведения выбранного формата, байт/с; известна после извлечения
+        self.bytes_per_second: Optional[float] = None
+        self.last_progress: float = time.monotonic()
+        # Флаг отмены проверяется в progress_hook: отмена задачи asyncio сама по себе поток yt-dlp не останавливает
+        self.cancelled: threading.Event = threading.Event()
 
     def progress_hook(self, status: Dict[str, Any]) -> None:
+        if self.cancelled.is_set():
+            raise DownloadCancelled("Загрузка отменена")
         tmp_path = status.get('tmpfilename')
+        if tmp_path:
+            self.tmp_path = tmp_path
         if tmp_path and not self.file_path:
             self.file_path = tmp_path
         if status.get('status') == 'downloading':
             downloaded = status.get('downloaded_bytes', 0)
-            if (not self.ready_to_play.is_set() and downloaded / self.bytes_per_second >= self.min_buffer_duration):
-                logger.debug("Буфер достигнут", extra={"downloaded": downloaded})
-                self.ready_to_play.set()
+            if downloaded > self.request.bytes:
+                self.last_progress = time.monotonic()
+            self.request.bytes = downloaded
+            if not self.buffered and self._buffer_ready(status):
+                logger.debug("Буфер достигнут", extra={"downloaded": downloaded, "speed": status.get('speed')})
+                self.buffered = True
+                self._signal(self.ready_to_play)
         elif status.get('status') in ('finished', 'error'):
             final_path = status.get('filename')
             if final_path:
                 self.file_path = final_path
-            self.ready_to_play.set()
-            self.download_finished.set()
+            self._signal(self.ready_to_play, self.download_finished)
+
+    def _signal(self, *events: asyncio.Event) -> None:
+        # progress_hook и _use_cached вызываются из потока yt-dlp, а asyncio.Event не потокобезопасен
+        for event in events:
+            self.loop.call_soon_threadsafe(event.set)
+
+    def _buffer_ready(self, status: Dict[str, Any]) -> bool:
+        downloaded = status.get('downloaded_bytes') or 0
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        if total and downloaded >= total:
+            return True
+        rate = self.bytes_per_second
+        duration = (self.info or {}).get('duration')
+        if not rate and total and duration:
+            rate = total / duration
+        rate = rate or BUFFER_DEFAULT_BITRATE * 1000 / 8
+        buffered = downloaded / rate
+        if buffered >= self.min_buffer_duration:
+            return True
+        # Загрузка заметно быстрее воспроизведения – запас только растёт, ждать полный буфер незачем
+        speed = status.get('speed')
+        return bool(speed) and buffered >= BUFFER_MIN_SECONDS and speed >= rate * BUFFER_SPEED_MARGIN
+
+    def _use_cached(self, key: Optional[str]) -> bool:
+        cached = audio_cache.lookup(key)
+        if not cached:
+            return False
+        self.file_path, self.info, self.loudnorm = cached
+        logger.info("Используется кэшированный файл", extra={"file": self.file_path, "key": key})
+        self._signal(self.ready_to_play, self.download_finished)
+        return True
+
+    @classmethod
+    async def acquire(cls, url: str, min_buffer_duration: int = 10,
+                      request: Optional[DownloadRequest] = None) -> "PartialDownloader":
+        """Запускает загрузку трека или подключается к уже идущей загрузке того же трека."""
+        downloader = cls(url, min_buffer_duration=min_buffer_duration, request=request)
+        # Ключ по URL определяется без сети, поэтому одинаковые ссылки объединяются ещё до извлечения
+        downloader.key = await asyncio.to_thread(key_from_url, url)
+        if downloader.key:
+            owner = downloads.claim(downloader.key, downloader)
+            if owner is not downloader:
+                owner.users += 1
+                owner.request.promote(downloader.request.priority)
+                logger.debug("Загрузка трека уже идёт, используем общую", extra={"key": owner.key})
+                return owner
+        downloader.task = asyncio.create_task(downloader.download())
+        return downloader
+
+    def release(self) -> None:
+        """Отказ одного из получателей; загрузка отменяется, только когда она больше никому не нужна."""
+        self.users -= 1
+        if self.users <= 0 and self.task and not self.task.done():
+            self.cancelled.set()
+            self.task.cancel()
+
+    @property
+    def failed(self) -> bool:
+        return self.task is not None and self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+    @property
+    def playable(self) -> bool:
+        return (self.ready_to_play.is_set() and not self.failed and self.file_path is not None
+                and os.path.exists(self.file_path))
+
+    def _join_in_flight(self, key: Optional[str]) -> bool:
+        # Ключ стал известен только после извлечения (например, поисковый запрос): тот же трек мог уже загружаться
+        if not key or self.key or self.low_quality:
+            return False
+        owner = downloads.claim(key, self)
+        if owner is self:
+            self.key = key
+            return False
+        # Ожидание ограничено: владелец может сам стоять в очереди планировщика за этим потоком
+        owner.finished.wait(timeout=60)
+        return self._use_cached(key)
 
     async def download(self) -> None:
+        try:
+            await self._download()
+        finally:
+            downloads.release(self.key, self)
+            self.finished.set()
+
+    async def _download(self) -> None:
+        # Проверяем индекс кэша до обращения к yt-dlp: повторное воспроизведение без сети и извлечения
+        if self._use_cached(self.key):
+            return
         local_opts = dict(ytdl_format_options)
         local_opts['progress_hooks'] = [self.progress_hook]
-        async with download_semaphore:
+        if self.low_quality:
+            local_opts['format'] = HEDGE_FORMAT
+            local_opts['outtmpl'] = f'{CACHE_DIR}/%(id)s_low.%(ext)s'
+        async with download_scheduler.slot(self.request):
+            # Простой для подстраховки отсчитывается с получения слота, а не с постановки в очередь планировщика
+            self.last_progress = time.monotonic()
             def _work_with_retry() -> Dict[str, Any]:
                 attempts = 3
                 delay = 1
                 for i in range(attempts):
                     try:
+                        meta = extract_info_sync(self.url, local_opts, need_formats=True)
+                        if meta is None:
+                            raise TrackDownloadError("Видео недоступно")
+                        if self.cancelled.is_set():
+                            raise DownloadCancelled("Загрузка отменена")  # извлечение не прерывается, загрузку не начинаем
+                        self.info = meta
+                        self.bytes_per_second = audio_bytes_per_second(meta)
+                        if self._use_cached(key_from_info(meta)) or self._join_in_flight(key_from_info(meta)):
+                            return meta
                         with youtube_dl.YoutubeDL(local_opts) as ydl:
-                            meta = ydl.extract_info(self.url, download=False)
-                            if meta is None:
-                                raise TrackDownloadError("Видео недоступно")
-                            self.info = meta
-                            if meta.get("id") and meta.get("ext"):
-                                cache_path = os.path.join(CACHE_DIR, f"{meta['id']}.{meta['ext']}")
-                                if os.path.exists(cache_path):
-                                    self.file_path = cache_path
-                                    logger.info("Используется кэшированный файл", extra={"file": cache_path})
-                                    self.ready_to_play.set()
-                                    return meta
                             ydl.process_ie_result(meta, download=True)
+                            if self.low_quality:
+                                return meta
+                            audio_cache.put(key_from_info(meta), self.file_path, meta)
+                            normalizer.submit(key_from_info(meta))
                             return meta
                     except Exception as e:
+                        if self.cancelled.is_set():
+                            raise DownloadCancelled("Загрузка отменена") from None
                         logger.error("Ошибка загрузки (попытка %d)", i + 1, extra={"error": str(e)})
                         if i == attempts - 1:
                             raise TrackDownloadError(str(e)) from e
-                        time.sleep(delay)
+                        if self.cancelled.wait(delay):
+                            raise DownloadCancelled("Загрузка отменена") from None
                         delay *= 2
                 raise TrackDownloadError("Не удалось загрузить трек")
+            work = asyncio.ensure_future(asyncio.to_thread(_work_with_retry))
             try:
-                info = await asyncio.to_thread(_work_with_retry)
+                info = await asyncio.shield(work)
                 self.info = info
+            except asyncio.CancelledError:
+                await self._stop_worker(work)
+                raise
             except Exception as e:
                 logger.error("Ошибка загрузки", extra={"error": str(e)})
                 self.ready_to_play.set()
@@ -80,17 +243,247 @@ class PartialDownloader:
             finally:
                 self.download_finished.set()
 
-class PartialYTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source: discord.FFmpegPCMAudio, *, data: Dict[str, Any], volume: float = 0.7,
-                 file_path: Optional[str] = None) -> None:
-        super().__init__(source, volume)
+    async def _stop_worker(self, work: asyncio.Future) -> None:
+        # Слот планировщика держим, пока поток yt-dlp не заметит флаг отмены (ближайший вызов progress_hook)
+        self.cancelled.set()
+        work.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await asyncio.wait({work}, timeout=DOWNLOAD_CANCEL_TIMEOUT)
+        if work.done():
+            self._remove_partial_files()
+        else:
+            logger.warning("Поток загрузки не остановился вовремя", extra={"url": self.url})
+            work.add_done_callback(lambda _: self._remove_partial_files())
+        logger.info("Загрузка отменена", extra={"url": self.url, "downloaded": self.request.bytes})
+
+    def _remove_partial_files(self) -> None:
+        """Удаляет недокачанные файлы отменённой загрузки: .part, фрагменты и служебный .ytdl."""
+        if not self.tmp_path:
+            return
+        base = self.tmp_path[:-len(".part")] if self.tmp_path.endswith(".part") else self.tmp_path
+        for path in glob.glob(glob.escape(self.tmp_path) + "*") + [base + ".ytdl"]:
+            if audio_cache.is_pinned(path) or audio_cache.contains_path(path) or not os.path.exists(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug("Не удалось удалить недокачанный файл", extra={"file": path, "error": str(e)})
+
+async def hedged_download(url: str, min_buffer_sec: int, request: DownloadRequest) -> PartialDownloader:
+    """Загрузка с подстраховкой: возвращает первую из загрузок, набравшую буфер.
+
+    Если основная загрузка упала или не продвигается HEDGE_DELAY секунд, параллельно запускается загрузка
+    в низком качестве. Проигравшая загрузка отменяется вместе с потоком yt-dlp.
+    """
+    primary = await PartialDownloader.acquire(url, min_buffer_duration=min_buffer_sec, request=request)
+    contenders = [primary]
+    waiters = {asyncio.create_task(primary.ready_to_play.wait()): primary}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HEDGE_TIMEOUT
+    winner: Optional[PartialDownloader] = None
+    try:
+        while winner is None:
+            winner = next((c for c in contenders if c.playable), None)
+            if winner:
+                break
+            if all(c.failed for c in contenders) and len(contenders) > 1:
+                reason = "загрузка отменена" if primary.task.cancelled() else primary.task.exception()
+                raise TrackDownloadError(f"Не удалось загрузить трек: {reason}")
+            # Ожидание слота планировщика – не простой: при занятом планировщике подстраховка лишь добавила бы загрузок
+            stalled = time.monotonic() - primary.last_progress if primary.request.started else 0.0
+            if len(contenders) == 1 and (primary.failed or stalled >= HEDGE_DELAY):
+                logger.warning("Основная загрузка не продвигается, параллельно пробуем низкое качество",
+                               extra={"url": url, "failed": primary.failed})
+                hedge = PartialDownloader(url, min_buffer_duration=min_buffer_sec, low_quality=True,
+                                          request=DownloadRequest(request.priority, request.guild_id))
+                hedge.task = asyncio.create_task(hedge.download())
+                contenders.append(hedge)
+                waiters[asyncio.create_task(hedge.ready_to_play.wait())] = hedge
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                raise TrackDownloadError("Время ожидания буферизации истекло")
+            if len(contenders) == 1:
+                timeout = min(timeout, max(HEDGE_DELAY - stalled, 0.1))
+            # Файл может появиться чуть позже сигнала о буфере – перепроверяем не реже раза в секунду
+            timeout = min(timeout, 1.0)
+            pending = [w for w in waiters if not w.done()]
+            if pending:
+                await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(min(timeout, 0.1))
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+        for contender in contenders:
+            if contender is not winner:
+                contender.release()
+    if winner is not primary:
+        logger.info("Воспроизводится запасное низкое качество", extra={"url": url})
+    return winner
+
+def track_data(info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    info = info or {}
+    return {
+        "title": info.get("title") or info.get("fulltitle") or "Unknown",
+        "url": info.get("webpage_url"),
+        "thumbnail": info.get("thumbnail"),
+        "duration": info.get("duration"),
+    }
+
+def make_audio_source(path: str, start: float = 0.0, *, loudnorm: Optional[Dict[str, Any]] = None,
+                      before_options: Optional[str] = None) -> discord.AudioSource:
+    """Создаёт источник FFmpeg для файла или потока, начиная с позиции start (секунды).
+
+    В режиме Opus громкость и фильтры применяет FFmpeg, а нормализованный файл с уже «запечённой» громкостью
+    копируется без перекодирования. PCM с PCMVolumeTransformer – запасной путь и режим кроссфейда (PLAYBACK_OPUS = False).
+    """
+    if start > 0:
+        before_options = f"-ss {start:.2f} {before_options or ''}".strip()
+    # Нормализованный файл уже прошёл loudnorm и остальную цепочку, громкость в нём учтена множителем "gain"
+    gain = PLAYBACK_VOLUME / (loudnorm.get("gain") or 1.0) if loudnorm is not None else PLAYBACK_VOLUME
+    if not PLAYBACK_OPUS:
+        source = discord.FFmpegPCMAudio(path, executable=FFMPEG_BINARY, before_options=before_options,
+                                        options=ffmpeg_opts_normalized if loudnorm is not None else ffmpeg_opts_no_fade)
+        return discord.PCMVolumeTransformer(source, gain)
+    if loudnorm is None:
+        options = ffmpeg_opts_opus
+    elif abs(gain - 1.0) < 0.001:
+        return discord.FFmpegOpusAudio(path, executable=FFMPEG_BINARY, codec="copy", before_options=before_options,
+                                       options=ffmpeg_opts_normalized)
+    else:
+        options = f"{ffmpeg_opts_normalized} -af volume={gain:.3f}"
+    return discord.FFmpegOpusAudio(path, executable=FFMPEG_BINARY, bitrate=OPUS_BITRATE, before_options=before_options,
+                                   options=options)
+
+def open_cached_source(key: Optional[str], path: str, start: float = 0.0, *,
+                       loudnorm: Optional[Dict[str, Any]] = None) -> discord.AudioSource:
+    """Источник для файла кэша; путь выбирается в момент запуска FFmpeg – частые треки читаются из памяти."""
+    return make_audio_source(hot_tier.path_for(key, path), start, loudnorm=loudnorm)
+
+def open_downloaded_source(downloader: PartialDownloader, start: float = 0.0) -> discord.AudioSource:
+    """Источник для загруженного трека. Путь берётся в момент запуска FFmpeg: при раннем старте это ещё .part,
+    который yt-dlp переименует по окончании загрузки, а нормализатор потом заменит файл в индексе кэша."""
+    key = downloader.key or key_from_info(downloader.info)
+    path, loudnorm = downloader.file_path, downloader.loudnorm
+    if not (path and os.path.exists(path)):
+        cached = audio_cache.lookup(key)
+        if cached:
+            path, _, loudnorm = cached
+    return open_cached_source(key, path, start, loudnorm=loudnorm)
+
+def audio_format(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Выбранный yt-dlp аудиоформат: сам info или аудиочасть requested_formats."""
+    requested = info.get("requested_formats")
+    if requested:
+        return next((f for f in requested if f.get("vcodec") in (None, "none")), requested[0])
+    return info
+
+def audio_bytes_per_second(info: Dict[str, Any]) -> Optional[float]:
+    """Скорость воспроизведения выбранного формата в байтах в секунду: по abr/tbr, иначе размер / длительность."""
+    fmt = audio_format(info)
+    kbps = fmt.get("abr") or fmt.get("tbr")
+    if kbps:
+        return kbps * 1000 / 8
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    duration = info.get("duration")
+    if size and duration:
+        return size / duration
+    return None
+
+def select_stream(info: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """Возвращает URL аудиопотока и before_options для FFmpeg (с HTTP-заголовками yt-dlp)."""
+    fmt = audio_format(info)
+    stream_url = fmt.get("url")
+    if not stream_url or fmt.get("protocol", "https") not in ("http", "https"):
+        return None
+    before_options = ffmpeg_stream_before_options
+    headers = fmt.get("http_headers") or info.get("http_headers") or {}
+    if headers:
+        header_str = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        before_options += f" -headers {shlex.quote(header_str)}"
+    return stream_url, before_options
+
+async def _fill_cache_in_background(url: str, guild_id: Optional[int] = None) -> None:
+    try:
+        downloader = await PartialDownloader.acquire(url, request=DownloadRequest(PRIORITY_BULK, guild_id))
+        await downloader.task
+    except Exception as e:
+        logger.debug("Фоновое кэширование не удалось", extra={"url": url, "error": str(e)})
+
+class PartialYTDLSource(discord.AudioSource):
+    def __init__(self, factory: Callable[[float], discord.AudioSource], *, data: Dict[str, Any],
+                 file_path: Optional[str] = None, downloader: Optional[PartialDownloader] = None) -> None:
+        # Фабрика источника с позиции: FFmpeg запускается только в open(), когда трек начинает играть,
+        # и с той же позиции после переподключения. В очереди трек – лишь описание без процесса
+        self.factory: Callable[[float], discord.AudioSource] = factory
+        self.source: Optional[discord.AudioSource] = None
+        self.start_offset: float = 0.0
+        self.frames: int = 0
+        # Загрузка, которая может ещё идти во время воспроизведения; отпускается при пропуске или удалении трека
+        self.downloader: Optional[PartialDownloader] = downloader
         self.data: Dict[str, Any] = data or {}
         self.title: str = self.data.get("title") or "Unknown"
         self.url: Optional[str] = self.data.get("url")
         self.thumbnail: Optional[str] = self.data.get("thumbnail")
         self.file_path: Optional[str] = file_path
+        # Файл может быть общим для нескольких серверов – удаляется только после снятия последней ссылки
+        self.pinned: bool = file_path is not None
+        audio_cache.pin(file_path)
+
+    def open(self) -> None:
+        if self.source is None:
+            self.source = self.factory(self.start_offset)
+
+    def read(self) -> bytes:
+        self.open()
+        data = self.source.read()
+        if data:
+            self.frames += 1
+        return data
+
+    @property
+    def position(self) -> float:
+        """Сколько секунд трека уже отдано в голосовой канал (кадр – 20 мс)."""
+        return self.start_offset + self.frames * discord.opus.Encoder.FRAME_LENGTH / 1000
+
+    def seek(self, position: float) -> None:
+        """Перезапускает FFmpeg с указанной позиции."""
+        self.cleanup()
+        self.start_offset = position
+        self.open()
+
+    def is_opus(self) -> bool:
+        # Для Opus-источника discord.py отправляет кадры как есть, минуя кодировщик в процессе бота
+        return self.source.is_opus() if self.source is not None else PLAYBACK_OPUS
+
+    def cleanup(self) -> None:
+        """Останавливает FFmpeg; следующий open() начнёт трек сначала."""
+        source, self.source = self.source, None
+        self.start_offset = 0.0
+        self.frames = 0
+        if source is not None:
+            source.cleanup()
+
+    def release_download(self) -> None:
+        downloader, self.downloader = self.downloader, None
+        if downloader:
+            downloader.release()
+
+    def discard(self) -> None:
+        """Трек убран из очереди, не начав играть: отменяем загрузку, закрываем FFmpeg и удаляем файл."""
+        self.release_download()
+        self.cleanup()
+        self.cleanup_file()
 
     def cleanup_file(self) -> None:
+        if not self.pinned:
+            return
+        self.pinned = False
+        if audio_cache.unpin(self.file_path):
+            return  # файл ещё воспроизводится в другом месте
+        # Файлы из индекса кэша не удаляются – ими управляет вытеснение AudioCache
+        if audio_cache.contains_path(self.file_path):
+            return
         if self.file_path and os.path.exists(self.file_path):
             try:
                 os.remove(self.file_path)
@@ -99,79 +492,54 @@ class PartialYTDLSource(discord.PCMVolumeTransformer):
                 logger.error("Ошибка удаления файла", extra={"file": self.file_path, "error": str(e)})
 
     @classmethod
-    async def create_partial(cls, url: str, min_buffer_sec: int = 10) -> "PartialYTDLSource":
-        if url.startswith("http") and not is_valid_url(url):
-            raise TrackDownloadError("Некорректный URL.")
-        downloader = PartialDownloader(url, min_buffer_duration=min_buffer_sec)
-        task = asyncio.create_task(downloader.download())
-        try:
-            await asyncio.wait_for(downloader.ready_to_play.wait(), timeout=60)
-        except asyncio.TimeoutError:
-            logger.warning("Время ожидания буферизации истекло, пробуем более низкое качество...")
-            low_opts = dict(ytdl_format_options)
-            low_opts['format'] = 'worstaudio/bestaudio'
-            low_opts['outtmpl'] = f'{CACHE_DIR}/%(id)s_low.%(ext)s'
-            info_low = None
+    async def create_stream(cls, url: str, guild_id: Optional[int] = None) -> Optional["PartialYTDLSource"]:
+        key = await asyncio.to_thread(key_from_url, url)
+        cached = audio_cache.lookup(key)
+        if not cached:
             try:
-                info_low = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(low_opts).extract_info(url, download=True))
+                info = await extract_info_cached(url, need_formats=True)
             except Exception as e:
-                raise TrackDownloadError(f"Не удалось загрузить трек (низкое качество): {e}") from e
-            low_path = None
-            if info_low:
-                low_path = os.path.join(CACHE_DIR, f"{info_low.get('id')}_low.{info_low.get('ext')}")
-            if not low_path or not os.path.exists(low_path):
-                raise TrackDownloadError("Не удалось получить аудио даже в низком качестве.")
-            source = discord.FFmpegPCMAudio(low_path, executable=FFMPEG_BINARY, options=ffmpeg_opts_no_fade)
-            data = {
-                "title": info_low.get("title") or info_low.get("fulltitle") or "Unknown",
-                "url": info_low.get("webpage_url"),
-                "thumbnail": info_low.get("thumbnail"),
-                "duration": info_low.get("duration"),
-            }
-            if not task.done():
-                task.cancel()
-            return cls(source, data=data, file_path=low_path)
-        if task.done() and task.exception():
-            exc = task.exception()
-            logger.warning("Ошибка загрузки трека, пробуем более низкое качество...", extra={"error": str(exc)})
-            low_opts = dict(ytdl_format_options)
-            low_opts['format'] = 'worstaudio/bestaudio'
-            low_opts['outtmpl'] = f'{CACHE_DIR}/%(id)s_low.%(ext)s'
-            info_low = None
-            try:
-                info_low = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(low_opts).extract_info(url, download=True))
-            except Exception as e:
-                raise TrackDownloadError(f"Не удалось загрузить трек (низкое качество): {e}") from e
-            low_path = None
-            if info_low:
-                low_path = os.path.join(CACHE_DIR, f"{info_low.get('id')}_low.{info_low.get('ext')}")
-            if not low_path or not os.path.exists(low_path):
-                raise TrackDownloadError("Не удалось получить аудио даже в низком качестве.")
-            source = discord.FFmpegPCMAudio(low_path, executable=FFMPEG_BINARY, options=ffmpeg_opts_no_fade)
-            data = {
-                "title": info_low.get("title") or info_low.get("fulltitle") or "Unknown",
-                "url": info_low.get("webpage_url"),
-                "thumbnail": info_low.get("thumbnail"),
-                "duration": info_low.get("duration"),
-            }
-            return cls(source, data=data, file_path=low_path)
-        if not downloader.file_path or not os.path.exists(downloader.file_path):
-            raise TrackDownloadError("Не удалось получить локальный файл. Проверьте установку FFmpeg.")
-        source = discord.FFmpegPCMAudio(downloader.file_path, executable=FFMPEG_BINARY, options=ffmpeg_opts_no_fade)
-        info_dict = downloader.info or {}
-        data = {
-            "title": info_dict.get("title") or info_dict.get("fulltitle") or "Unknown",
-            "url": info_dict.get("webpage_url"),
-            "thumbnail": info_dict.get("thumbnail"),
-            "duration": info_dict.get("duration"),
-        }
-        return cls(source, data=data, file_path=downloader.file_path)
+                logger.warning("Не удалось получить поток, используем загрузку", extra={"error": str(e)})
+                return None
+            if not info:
+                return None
+            key = key_from_info(info)
+            cached = audio_cache.lookup(key)
+        if cached:
+            file_path, info, loudnorm = cached
+            factory = functools.partial(open_cached_source, key, file_path, loudnorm=loudnorm)
+            return cls(factory, data=track_data(info), file_path=file_path)
+        stream = select_stream(info)
+        if not stream:
+            return None
+        stream_url, before_options = stream
+        factory = functools.partial(make_audio_source, stream_url, before_options=before_options)
+        if DIRECT_STREAM_BACKGROUND_CACHE:
+            asyncio.create_task(_fill_cache_in_background(url, guild_id))
+        logger.info("Прямое воспроизведение потока", extra={"title": info.get("title")})
+        return cls(factory, data=track_data(info))
+
+    @classmethod
+    async def create_partial(cls, url: str, min_buffer_sec: int = 10,
+                             request: Optional[DownloadRequest] = None) -> "PartialYTDLSource":
+        request = request or DownloadRequest()
+        if url.startswith("http") and not is_valid_url(url):
+            raise TrackDownloadError("Некорректный URL.")
+        started = time.monotonic()
+        source = await cls.create_stream(url, request.guild_id) if DIRECT_STREAM else None
+        if source is None:
+            downloader = await hedged_download(url, min_buffer_sec, request)
+            if not downloader.file_path or not os.path.exists(downloader.file_path):
+                raise TrackDownloadError("Не удалось получить локальный файл. Проверьте установку FFmpeg.")
+            factory = functools.partial(open_downloaded_source, downloader)
+            source = cls(factory, data=track_data(downloader.info), file_path=downloader.file_path, downloader=downloader)
+        # Время до готовности трека к воспроизведению: из кэша, потоком или после буферизации
+        analytics.record_download(request.guild_id, source.url, time.monotonic() - started)
+        return source
 
 async def find_alternative_tracks(query: str) -> List[Dict[str, Any]]:
-    search_query = f"ytsearch10:{query}"
     try:
-        info = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(ytdl_format_options).extract_info(search_query, download=False))
-        results = info.get("entries", [])
+        results = await search_service.search(query)
         results.sort(key=lambda x: 0 if "llyrics" in (((x.get("title") or "").lower()) + ((x.get("description") or "").lower())) else 1)
         return results
     except Exception as e:
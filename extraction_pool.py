@@ -0,0 +1,163 @@
+import queue
+import asyncio
+import functools
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future, wait, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any, Tuple
+from config import (ytdl_format_options, EXTRACTION_USE_PROCESSES, EXTRACTION_WORKERS, EXTRACTION_MAX_PENDING,
+                    EXTRACTION_TIMEOUT, EXTRACTION_TASKS_PER_WORKER)
+from extraction_worker import extract_info, run_extraction, init_worker, ExtractionError
+from logging_config import logger
+
+# Опции yt-dlp, которые нельзя передать в другой процесс (функции и объекты текущего процесса)
+UNPICKLABLE_OPTS = ("progress_hooks", "postprocessor_hooks", "logger")
+# Как часто проверять, взял ли воркер запрос: таймаут отсчитывается только с этого момента
+START_POLL_INTERVAL: float = 0.05
+# Сколько раз запрос отправляется заново, если пул сломался не из-за него (пересоздан по чужому таймауту)
+BROKEN_POOL_RETRIES: int = 1
+
+class ExtractionService:
+    """Извлечение метаданных yt-dlp в пуле процессов, чтобы разбор не конкурировал за GIL с голосом и шлюзом."""
+    def __init__(self, use_processes: bool, workers: int, max_pending: int, timeout: float, tasks_per_worker: int) -> None:
+        self.use_processes = use_processes
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.tasks_per_worker = tasks_per_worker
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.started_queue: Optional[multiprocessing.Queue] = None
+        self.started: Dict[int, bool] = {}  # незавершённые запросы: взял ли их воркер в работу
+        self.task_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.pending: int = 0
+        self.recycled: int = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                context = multiprocessing.get_context("spawn")
+                # Своя очередь на каждый пул: принудительно завершённый воркер мог оставить её недописанной
+                self.started_queue = context.Queue()
+                # max_tasks_per_child пересоздаёт воркеры после N запросов (yt-dlp со временем копит память)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                    max_tasks_per_child=self.tasks_per_worker,
+                                                    initializer=init_worker, initargs=(self.started_queue,))
+            return self.executor
+
+    def _recycle(self, executor: ProcessPoolExecutor) -> None:
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+            self.recycled += 1
+        # Зависший воркер не остановить через shutdown – завершаем процессы пула принудительно.
+        # Пул после этого сломан целиком, чужие запросы из него повторяются в новом (см. _failed)
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+        logger.warning("Пул извлечения пересоздан", extra={"recycled": self.recycled})
+
+    def _release(self, task_id: int, _: Optional[Future]) -> None:
+        with self.lock:
+            self.pending -= 1
+            self.started.pop(task_id, None)
+
+    def _is_started(self, task_id: int) -> bool:
+        with self.lock:
+            while self.started_queue is not None:
+                try:
+                    started = self.started_queue.get_nowait()
+                except (queue.Empty, OSError, ValueError):
+                    break
+                if started in self.started:
+                    self.started[started] = True
+            return self.started.get(task_id, False)
+
+    def _submit(self, query: str, opts: Dict[str, Any]) -> Tuple[Future, ProcessPoolExecutor, int]:
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise ExtractionError("Очередь извлечения переполнена, попробуйте позже.")
+            self.pending += 1
+            task_id = next(self.task_ids)
+            self.started[task_id] = False
+        opts = {k: v for k, v in opts.items() if k not in UNPICKLABLE_OPTS}
+        executor = self._get_executor()
+        try:
+            future = executor.submit(run_extraction, task_id, query, opts)
+        except (BrokenProcessPool, RuntimeError):
+            self._recycle(executor)
+            executor = self._get_executor()
+            try:
+                future = executor.submit(run_extraction, task_id, query, opts)
+            except Exception:
+                self._release(task_id, None)
+                raise
+        future.add_done_callback(functools.partial(self._release, task_id))
+        return future, executor, task_id
+
+    def _failed(self, executor: ProcessPoolExecutor, attempt: int) -> bool:
+        """Пул сломался, пока запрос ждал результата. True – запрос стоит отправить в новый пул.
+
+        Принудительное завершение зависшего воркера ломает весь ProcessPoolExecutor, и чужие запросы
+        получают BrokenProcessPool – они не виноваты и повторяются в новом пуле, а не падают.
+        """
+        self._recycle(executor)
+        return attempt < BROKEN_POOL_RETRIES
+
+    def extract_sync(self, query: str, opts: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        opts = opts or ytdl_format_options
+        if not self.use_processes:
+            return extract_info(query, opts)
+        attempt = 0
+        while True:
+            future, executor, task_id = self._submit(query, opts)
+            try:
+                # Время в очереди пула за другими запросами и запуск воркера не считаются в таймаут
+                while not future.done() and not self._is_started(task_id):
+                    wait([future], timeout=START_POLL_INTERVAL)
+                return future.result(timeout=self.timeout)
+            except FuturesTimeoutError:
+                self._recycle(executor)
+                raise ExtractionError(f"Превышено время извлечения ({self.timeout} с)")
+            except BrokenProcessPool as e:
+                if not self._failed(executor, attempt):
+                    raise ExtractionError("Процесс извлечения завершился аварийно") from e
+                attempt += 1
+
+    async def extract(self, query: str, opts: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        opts = opts or ytdl_format_options
+        if not self.use_processes:
+            return await asyncio.to_thread(extract_info, query, opts)
+        attempt = 0
+        while True:
+            future, executor, task_id = self._submit(query, opts)
+            result = asyncio.wrap_future(future)
+            try:
+                # Время в очереди пула за другими запросами и запуск воркера не считаются в таймаут
+                while not future.done() and not self._is_started(task_id):
+                    await asyncio.wait({result}, timeout=START_POLL_INTERVAL)
+                return await asyncio.wait_for(result, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._recycle(executor)
+                raise ExtractionError(f"Превышено время извлечения ({self.timeout} с)")
+            except BrokenProcessPool as e:
+                if not self._failed(executor, attempt):
+                    raise ExtractionError("Процесс извлечения завершился аварийно") from e
+                attempt += 1
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"pending": self.pending, "workers": self.workers, "recycled": self.recycled}
+
+# Глобальный сервис извлечения
+extraction_service = ExtractionService(EXTRACTION_USE_PROCESSES, EXTRACTION_WORKERS, EXTRACTION_MAX_PENDING,
+                                       EXTRACTION_TIMEOUT, EXTRACTION_TASKS_PER_WORKER)
@@ -0,0 +1,30 @@
+from typing import Optional, Dict, Any
+import multiprocessing
+import yt_dlp as youtube_dl
+
+# Модуль нарочно без зависимостей проекта: он импортируется в дочерних процессах пула извлечения
+
+class ExtractionError(Exception):
+    pass
+
+# Очередь, в которую воркер сообщает номер взятого запроса (задаётся при запуске процесса пула)
+started_queue: Optional[multiprocessing.Queue] = None
+
+def init_worker(queue: multiprocessing.Queue) -> None:
+    global started_queue
+    started_queue = queue
+
+def run_extraction(task_id: int, query: str, opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """extract_info в процессе пула: сначала сообщает основному процессу, что запрос начат."""
+    if started_queue is not None:
+        started_queue.put(task_id)
+    return extract_info(query, opts)
+
+def extract_info(query: str, opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        with youtube_dl.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(query, download=False)
+            return ydl.sanitize_info(info)
+    except Exception as e:
+        # Исключения yt-dlp содержат exc_info и не сериализуются – передаём в основной процесс только текст
+        raise ExtractionError(str(e)) from None
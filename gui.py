@@ -6,6 +6,7 @@ from PySide6.QtGui import QIcon, QPainter, QLinearGradient, QColor, QGraphicsDro
 from PySide6.QtCore import QTimer, Qt, Signal
 from logging_config import log_queue, logger
 from utils import format_duration
+from music_queue import track_states
 
 class CustomProgressBar(QProgressBar):
     def paintEvent(self, event):
@@ -313,9 +314,10 @@ class BotGUI(QMainWindow):
 
     def update_track_info(self) -> None:
         try:
-            # Пример получения информации о треке (реализация зависит от глобального состояния)
-            state = asyncio.run_coroutine_threadsafe(track_state.get_state(), asyncio.get_event_loop()).result(timeout=1)
-            self.track_info_signal.emit(state)
+            # Реестр читается без блокировок, поэтому обращаемся к нему прямо из потока GUI
+            states = track_states.snapshot()
+            if states:
+                self.track_info_signal.emit(max(states.values(), key=lambda st: st["start_time"]))
         except Exception as e:
             logger.error("Ошибка обновления информации о треке", extra={"error": str(e)})
 
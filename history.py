@@ -0,0 +1,75 @@
+import os
+import json
+import time
+from typing import Optional, List, Iterator
+from config import HISTORY_SIZE, HISTORY_SPILL, HISTORY_DIR
+from logging_config import logger
+
+class HistoryEntry:
+    """Запись истории: только то, что нужно показать или сыграть снова – без источника и FFmpeg."""
+    __slots__ = ("url", "title", "played_at")
+
+    def __init__(self, url: Optional[str], title: str, played_at: float) -> None:
+        self.url = url
+        self.title = title
+        self.played_at = played_at
+
+class PlayHistory:
+    """История сервера в кольцевом буфере фиксированной ёмкости: память не растёт со временем работы.
+
+    Вытесненные записи при HISTORY_SPILL дописываются в журнал (JSON по строке) и не теряются.
+    """
+    def __init__(self, capacity: int = HISTORY_SIZE, log_path: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.entries: List[Optional[HistoryEntry]] = [None] * capacity
+        self.start: int = 0
+        self.count: int = 0
+        self.log_path = log_path
+
+    @classmethod
+    def for_guild(cls, guild_id: Optional[int]) -> "PlayHistory":
+        log_path = os.path.join(HISTORY_DIR, f"{guild_id}.jsonl") if HISTORY_SPILL and guild_id is not None else None
+        return cls(log_path=log_path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[HistoryEntry]:
+        for i in range(self.count):
+            yield self.entries[(self.start + i) % self.capacity]
+
+    def append(self, url: Optional[str], title: str, played_at: Optional[float] = None) -> None:
+        entry = HistoryEntry(url, title, played_at or time.time())
+        if self.count < self.capacity:
+            self.entries[(self.start + self.count) % self.capacity] = entry
+            self.count += 1
+            return
+        self._spill(self.entries[self.start])
+        self.entries[self.start] = entry
+        self.start = (self.start + 1) % self.capacity
+
+    def recent(self, count: int) -> List[HistoryEntry]:
+        """Последние count записей, от старых к новым."""
+        count = min(count, self.count)
+        return [self.entries[(self.start + self.count - count + i) % self.capacity] for i in range(count)]
+
+    def last(self) -> Optional[HistoryEntry]:
+        return self.entries[(self.start + self.count - 1) % self.capacity] if self.count else None
+
+    def close(self) -> None:
+        """Сбрасывает оставшиеся записи в журнал (очередь сервера удаляется)."""
+        for entry in self:
+            self._spill(entry)
+        self.entries = [None] * self.capacity
+        self.start = self.count = 0
+
+    def _spill(self, entry: HistoryEntry) -> None:
+        if not self.log_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"url": entry.url, "title": entry.title, "played_at": entry.played_at},
+                                   ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error("Ошибка записи журнала истории", extra={"file": self.log_path, "error": str(e)})
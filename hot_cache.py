@@ -0,0 +1,160 @@
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Set
+from config import HOT_CACHE_ENABLED, HOT_CACHE_DIR, HOT_CACHE_SIZE, HOT_PROMOTE_HITS
+from audio_cache import AudioCache, audio_cache
+from logging_config import logger
+
+class HotEntry:
+    __slots__ = ("src", "path", "size", "hits")
+
+    def __init__(self, src: str, path: str, size: int) -> None:
+        self.src = src
+        self.path = path
+        self.size = size
+        self.hits = 0
+
+class HotTier:
+    """Горячий уровень над дисковым кэшем: копии самых частых треков в памяти (tmpfs).
+
+    FFmpeg читает такую копию по пути, как обычный файл, но без обращений к диску. Трек переносится
+    наверх после HOT_PROMOTE_HITS открытий, а при нехватке HOT_CACHE_SIZE вытесняется самый редкий
+    (частоты периодически затухают в sweep()). Копии играющих треков не вытесняются.
+    """
+    def __init__(self, directory: str = HOT_CACHE_DIR, budget: int = HOT_CACHE_SIZE,
+                 promote_hits: int = HOT_PROMOTE_HITS, cache: AudioCache = audio_cache,
+                 enabled: bool = HOT_CACHE_ENABLED) -> None:
+        self.directory = directory
+        self.budget = budget
+        self.promote_hits = promote_hits
+        self.cache = cache
+        self.enabled = enabled and bool(directory)
+        self.lock = threading.Lock()
+        self.entries: Dict[str, HotEntry] = {}
+        self.counts: Dict[str, float] = {}
+        self.copying: Set[str] = set()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.promotions: int = 0
+        self.demotions: int = 0
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        """Готовит каталог уровня. Вызывается при загрузке кога, а не при импорте: модуль импортируют
+        и дочерние процессы, и очистка каталога там стёрла бы копии работающего бота."""
+        if not self.enabled or self.executor is not None:
+            return
+        try:
+            # Копии прошлого запуска не учтены в бюджете – каталог принадлежит только горячему уровню
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning("Горячий кэш недоступен", extra={"dir": self.directory, "error": str(e)})
+            self.enabled = False
+            return
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hot-cache")
+
+    def path_for(self, key: Optional[str], path: str) -> str:
+        """Путь, по которому FFmpeg читает трек: копия в памяти, если она есть; учитывает обращение."""
+        if self.executor is None or not key:
+            return path
+        path = os.path.abspath(path)
+        with self.lock:
+            count = self.counts[key] = self.counts.get(key, 0) + 1
+            entry = self.entries.get(key)
+            if entry and entry.src == path:
+                if os.path.exists(entry.path):
+                    entry.hits += 1
+                    self.hits += 1
+                    return entry.path
+                self._remove(key)  # копию удалили извне – пусть трек снова поднимется наверх
+            self.misses += 1
+            promote = count >= self.promote_hits and key not in self.copying
+            if promote:
+                self.copying.add(key)
+        if promote:
+            self.executor.submit(self._promote, key, path)
+        return path
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    def _make_room(self, size: int, count: float) -> bool:
+        while self.size + size > self.budget:
+            victims = [k for k, e in self.entries.items() if not self.cache.is_pinned(e.src)]
+            if not victims:
+                return False
+            victim = min(victims, key=lambda k: self.counts.get(k, 0))
+            if self.counts.get(victim, 0) >= count:
+                return False  # более частый трек не вытесняем ради более редкого
+            self._remove(victim)
+            self.demotions += 1
+        return True
+
+    def _promote(self, key: str, src: str) -> None:
+        try:
+            # Только завершённые файлы из индекса: недокачанный файл ещё растёт
+            if not self.cache.contains_path(src) or not os.path.exists(src):
+                return
+            size = os.path.getsize(src)
+            with self.lock:
+                old = self.entries.get(key)
+                if old and old.src == src and os.path.exists(old.path):
+                    return
+                if old:
+                    self._remove(key)  # устаревшая копия (файл заменён нормализованным)
+                if size > self.budget or not self._make_room(size, self.counts.get(key, 0)):
+                    return
+                self.size += size  # место занято до окончания копирования
+            dst = os.path.join(self.directory, re.sub(r"[^\w.-]", "_", key) + os.path.splitext(src)[1])
+            try:
+                shutil.copyfile(src, dst + ".part")
+                os.replace(dst + ".part", dst)
+            except OSError as e:
+                with self.lock:
+                    self.size -= size
+                logger.error("Ошибка копирования в горячий кэш", extra={"key": key, "error": str(e)})
+                return
+            with self.lock:
+                self.entries[key] = HotEntry(src, dst, size)
+                self.promotions += 1
+            logger.debug("Трек в горячем кэше", extra={"key": key, "size": size})
+        finally:
+            with self.lock:
+                self.copying.discard(key)
+
+    def sweep(self) -> None:
+        """Затухание частот и удаление копий, чьи файлы ушли из дискового кэша."""
+        if self.executor is None:
+            return
+        with self.lock:
+            for key in list(self.entries):
+                entry = self.entries[key]
+                if not os.path.exists(entry.src) or not os.path.exists(entry.path):
+                    self._remove(key)
+                    self.demotions += 1
+            self.counts = {k: c / 2 for k, c in self.counts.items() if c >= 1 or k in self.entries}
+
+    def shutdown(self) -> None:
+        executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"enabled": self.executor is not None, "entries": len(self.entries), "size": self.size, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "promotions": self.promotions, "demotions": self.demotions}
+
+# Глобальный горячий уровень кэша
+hot_tier = HotTier()
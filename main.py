@@ -1,14 +1,19 @@
 import asyncio
 import sys
 from discord.ext import commands
-from config import TOKEN, intents
-from music_cog import Music, GLOBAL_DISCORD_LOOP, GLOBAL_MUSIC_COG
+from config import TOKEN, intents, DISCORD_MAX_RATELIMIT_TIMEOUT
 from dependencies import ensure_admin, ensure_dependencies
 
+# Пул извлечения запускает воркеры через spawn, и каждый из них заново импортирует этот модуль как __mp_main__.
+# Поэтому music_cog (и глобальные кэши, базы и горячий уровень за ним) импортируется только в main()
+GLOBAL_DISCORD_LOOP = None
+GLOBAL_MUSIC_COG = None
+
 def main():
+    from music_cog import Music
     ensure_dependencies()
     ensure_admin()
-    bot = commands.Bot(command_prefix="!", intents=intents)
+    bot = commands.Bot(command_prefix="!", intents=intents, max_ratelimit_timeout=DISCORD_MAX_RATELIMIT_TIMEOUT)
     music_cog = Music(bot)
     bot.add_cog(music_cog)
     global GLOBAL_DISCORD_LOOP, GLOBAL_MUSIC_COG
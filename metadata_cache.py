@@ -0,0 +1,108 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from config import METADATA_CACHE_SIZE, METADATA_TTL, METADATA_FORMAT_TTL
+from extraction_pool import extraction_service
+from logging_config import logger
+
+# Поля со ссылками на медиапотоки: подписанные URL истекают раньше, чем остальные метаданные
+EXPIRING_FIELDS = ("formats", "requested_formats", "requested_downloads", "url", "manifest_url", "fragments", "http_headers")
+# Параметры URL, которые не влияют на содержимое (трекинг, позиция и т.п.)
+IGNORED_URL_PARAMS = {"si", "feature", "pp", "t", "start_radio", "index", "ab_channel", "utm_source", "utm_medium", "utm_campaign"}
+
+def normalize_query(query: str) -> str:
+    query = query.strip()
+    if not query.startswith("http"):
+        prefix, sep, text = query.partition(":")
+        if sep and prefix.startswith("ytsearch"):
+            return f"{prefix}:{' '.join(text.casefold().split())}"
+        return " ".join(query.casefold().split())
+    parsed = urlparse(query)
+    host = parsed.netloc.lower()
+    if host.startswith(("www.", "m.", "music.")):
+        host = host.split(".", 1)[1]
+    params = sorted((k, v) for k, v in parse_qsl(parsed.query) if k not in IGNORED_URL_PARAMS)
+    return urlunparse((parsed.scheme.lower(), host, parsed.path.rstrip("/"), "", urlencode(params), ""))
+
+def strip_expiring(info: Dict[str, Any]) -> Dict[str, Any]:
+    # У плоских записей (_type=url) поле url – ссылка на страницу, а не на медиапоток
+    keep = ("url",) if info.get("_type") in ("url", "url_transparent") else ()
+    stripped = {k: v for k, v in info.items() if k not in EXPIRING_FIELDS or k in keep}
+    if isinstance(info.get("entries"), list):
+        stripped["entries"] = [strip_expiring(e) if isinstance(e, dict) else e for e in info["entries"]]
+    return stripped
+
+class MetadataCache:
+    def __init__(self, max_entries: int, ttl: float, format_ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.format_ttl = format_ttl
+        self.entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, query: str, need_formats: bool = False, variant: str = "") -> Optional[Dict[str, Any]]:
+        key = normalize_query(query) + variant
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, info = entry
+            age = now - stored_at
+            if age > self.ttl or (need_formats and age > self.format_ttl):
+                self.misses += 1
+                if age > self.ttl:
+                    del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        if age > self.format_ttl:
+            return strip_expiring(info)
+        return copy.deepcopy(info)
+
+    def put(self, query: str, info: Optional[Dict[str, Any]], variant: str = "") -> None:
+        if not info:
+            return
+        key = normalize_query(query) + variant
+        with self.lock:
+            self.entries[key] = (time.time(), copy.deepcopy(info))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+# Глобальный кэш результатов extract_info
+metadata_cache = MetadataCache(METADATA_CACHE_SIZE, METADATA_TTL, METADATA_FORMAT_TTL)
+
+def _variant(opts: Optional[Dict[str, Any]]) -> str:
+    # Плоское извлечение (extract_flat) даёт другой набор полей – храним его отдельно от полного
+    return "#flat" if opts and opts.get("extract_flat") else ""
+
+def extract_info_sync(query: str, opts: Optional[Dict[str, Any]] = None, need_formats: bool = False) -> Dict[str, Any]:
+    variant = _variant(opts)
+    info = metadata_cache.get(query, need_formats=need_formats, variant=variant)
+    if info is not None:
+        logger.debug("Метаданные взяты из кэша", extra={"query": query})
+        return info
+    info = extraction_service.extract_sync(query, opts)
+    metadata_cache.put(query, info, variant=variant)
+    return info
+
+async def extract_info_cached(query: str, opts: Optional[Dict[str, Any]] = None, need_formats: bool = False) -> Dict[str, Any]:
+    variant = _variant(opts)
+    info = metadata_cache.get(query, need_formats=need_formats, variant=variant)
+    if info is not None:
+        logger.debug("Метаданные взяты из кэша", extra={"query": query})
+        return info
+    info = await extraction_service.extract(query, opts)
+    metadata_cache.put(query, info, variant=variant)
+    return info
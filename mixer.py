@@ -0,0 +1,132 @@
+import audioop
+import threading
+from collections import deque
+from typing import Optional, Callable, Deque, List, Tuple
+import discord
+from config import CROSSFADE_SECONDS, MIXER_PRELOAD_SECONDS
+from downloader import PartialYTDLSource
+
+FRAME_SECONDS: float = discord.opus.Encoder.FRAME_LENGTH / 1000
+FRAME_BYTES: int = discord.opus.Encoder.FRAME_SIZE  # 20 мс PCM s16le, стерео, 48 кГц
+
+class TrackMixer(discord.AudioSource):
+    """Источник голосового клиента, который сам переключает треки сервера.
+
+    Следующий трек готовится заранее (enqueue), а переход происходит внутри read() в потоке плеера:
+    без остановки плеера, вызова after и повторного vc.play через цикл событий. В режиме PCM соседние
+    треки сводятся кроссфейдом (audioop умножает и складывает кадры целиком), Opus-кадры смешивать
+    нельзя – для них переход только бесшовный.
+    """
+    def __init__(self, track: PartialYTDLSource, *, crossfade: float = CROSSFADE_SECONDS,
+                 preload: float = MIXER_PRELOAD_SECONDS,
+                 on_change: Optional[Callable[[PartialYTDLSource, PartialYTDLSource], None]] = None,
+                 on_need_next: Optional[Callable[[], None]] = None) -> None:
+        self.current: Optional[PartialYTDLSource] = track
+        self.incoming: Optional[PartialYTDLSource] = None  # трек, который сейчас нарастает в кроссфейде
+        self.upcoming: Deque[PartialYTDLSource] = deque()
+        self.opus: bool = track.is_opus()
+        self.fade_frames: int = 0 if self.opus else int(crossfade / FRAME_SECONDS)
+        self.fade_pos: int = 0
+        self.preload = preload
+        # Колбэки вызываются из потока плеера: они не должны блокировать (только call_soon_threadsafe)
+        self.on_change = on_change
+        self.on_need_next = on_need_next
+        self.requested: bool = False
+        self.finished: bool = False
+        self.lock = threading.Lock()
+
+    def is_opus(self) -> bool:
+        return self.opus
+
+    def _remaining(self) -> Optional[float]:
+        duration = self.current.data.get("duration")
+        return duration - self.current.position if duration else None
+
+    def _switch(self, track: PartialYTDLSource) -> None:
+        previous, self.current = self.current, track
+        self.requested = False
+        if previous is track:
+            # Режим повтора поставил в очередь тот же объект: перематываем его в начало, а не закрываем
+            track.seek(0.0)
+        else:
+            previous.cleanup()
+        if self.on_change:
+            self.on_change(previous, track)
+
+    def _mix(self, outgoing: bytes) -> bytes:
+        incoming = self.incoming.read()
+        self.fade_pos += 1
+        gain = min(self.fade_pos / self.fade_frames, 1.0)
+        mixed = audioop.add(audioop.mul(outgoing.ljust(FRAME_BYTES, b"\0"), 2, 1.0 - gain),
+                            audioop.mul(incoming.ljust(FRAME_BYTES, b"\0"), 2, gain), 2)
+        if not outgoing or self.fade_pos >= self.fade_frames:
+            track, self.incoming = self.incoming, None
+            self._switch(track)
+        return mixed
+
+    def read(self) -> bytes:
+        with self.lock:
+            if self.finished or self.current is None:
+                return b""
+            remaining = self._remaining()
+            if not self.requested and self.on_need_next and remaining is not None \
+                    and remaining <= self.preload + self.fade_frames * FRAME_SECONDS:
+                self.requested = True
+                self.on_need_next()
+            # Трек не сводится сам с собой – повтор того же объекта идёт без кроссфейда
+            if self.incoming is None and self.upcoming and self.upcoming[0] is not self.current and self.fade_frames \
+                    and remaining is not None and remaining <= self.fade_frames * FRAME_SECONDS:
+                self.incoming = self.upcoming.popleft()
+                self.fade_pos = 0
+            data = self.current.read()
+            if self.incoming is not None:
+                return self._mix(data)
+            # Трек закончился: сразу читаем следующий, плеер не замечает перехода
+            while not data and self.upcoming:
+                self._switch(self.upcoming.popleft())
+                data = self.current.read()
+            if not data:
+                self.finished = True
+            return data
+
+    def enqueue(self, track: PartialYTDLSource) -> bool:
+        """Добавляет подготовленный трек. False – микшер уже завершился, трек нужно запускать заново."""
+        with self.lock:
+            if self.finished:
+                return False
+            self.upcoming.append(track)
+            return True
+
+    def skip(self) -> bool:
+        """Переход к следующему треку без кроссфейда. False – следующий трек ещё не подготовлен."""
+        with self.lock:
+            if self.incoming is not None:
+                track, self.incoming = self.incoming, None
+            elif self.upcoming:
+                track = self.upcoming.popleft()
+            else:
+                return False
+            self._switch(track)
+            return True
+
+    def drop_upcoming(self) -> List[PartialYTDLSource]:
+        """Убирает подготовленные треки (очистка очереди); текущий доигрывает."""
+        with self.lock:
+            dropped = list(self.upcoming)
+            self.upcoming.clear()
+            return dropped
+
+    def detach(self) -> Tuple[Optional[PartialYTDLSource], List[PartialYTDLSource]]:
+        """Передаёт треки вызывающему после остановки плеера: cleanup() микшера их больше не трогает."""
+        with self.lock:
+            self.finished = True
+            track, self.current = self.current, None
+            pending = ([self.incoming] if self.incoming is not None else []) + list(self.upcoming)
+            self.incoming = None
+            self.upcoming.clear()
+            return track, pending
+
+    def cleanup(self) -> None:
+        track, pending = self.detach()
+        for item in ([track] if track else []) + pending:
+            item.cleanup()
@@ -6,54 +6,102 @@ import discord
 from discord.ext import commands
 from typing import Optional, Dict, Any, List
 from utils import create_embed, is_valid_url, format_duration, create_progress_bar
-from downloader import PartialYTDLSource, find_alternative_tracks, TrackDownloadError
-from music_queue import MusicQueue, track_state, CacheCleaner
-from config import CACHE_DIR, MAX_CACHE_SIZE, FFMPEG_BINARY, ffmpeg_opts_no_fade, ytdl_format_options
+from downloader import PartialYTDLSource, find_alternative_tracks, TrackDownloadError, downloads
+from download_scheduler import download_scheduler, DownloadRequest, PRIORITY_INTERACTIVE
+from metadata_cache import extract_info_cached
+from search import search_service
+from extraction_pool import extraction_service
+from normalizer import normalizer
+from voice import voice_manager, VOICE_CLOSED
+from mixer import TrackMixer
+from analytics import analytics
+from warmup import cache_warmer
+from music_queue import MusicQueue, LazyTrack, track_states, CacheCleaner
+from prefetcher import Prefetcher
+from progress import ProgressScheduler, ProgressFrame
+from audio_cache import audio_cache
+from hot_cache import hot_tier
+from config import (FFMPEG_BINARY, ffmpeg_opts_no_fade, ytdl_playlist_options, PLAYLIST_MAX_ENTRIES, LIST_PAGE_SIZE,
+                    PROGRESS_BAR_LENGTH, GAPLESS_PLAYBACK, ANALYTICS_FLUSH_INTERVAL,
+                    WARMUP_ENABLED, WARMUP_INTERVAL)
 from logging_config import logger
 
+SPINNER_FRAMES = ["◐", "◓", "◑", "◒"]
+
 # Глобальные переменные для использования в асинхронных вызовах (будут установлены в main.py)
 GLOBAL_DISCORD_LOOP = None
 GLOBAL_MUSIC_COG = None
 
-async def ensure_voice_client(ctx: commands.Context, retries: int = 5) -> Optional[discord.VoiceClient]:
+async def ensure_voice_client(ctx: commands.Context) -> Optional[discord.VoiceClient]:
     if not ctx.author.voice:
         await ctx.send(embed=create_embed("❌ Ошибка", "*Вы не в голосовом канале!*", discord.Color.red()))
         return None
-    channel = ctx.author.voice.channel
-    vc = ctx.voice_client
-    for attempt in range(retries):
-        try:
-            if vc:
-                if vc.channel.id != channel.id:
-                    await vc.move_to(channel)
-                if not vc.is_connected():
-                    await asyncio.sleep(1)
-                return vc
-            else:
-                vc = await channel.connect(timeout=60)
-                await asyncio.sleep(1)
-                return vc
-        except Exception as e:
-            logger.error("Ошибка подключения", extra={"attempt": attempt + 1, "error": str(e)})
-            await asyncio.sleep(2 ** (attempt + 1))
-    await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось подключиться к каналу.*", discord.Color.red()))
-    return None
+    vc = await voice_manager.get(ctx.guild).connect(ctx.author.voice.channel)
+    if not vc:
+        await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось подключиться к каналу.*", discord.Color.red()))
+    return vc
+
+class GuildPlayback:
+    """Состояние воспроизведения одного сервера с собственной блокировкой смены треков."""
+    def __init__(self, guild_id: int) -> None:
+        self.guild_id: int = guild_id
+        self.lock = asyncio.Lock()
+        self.current_track: Optional[PartialYTDLSource] = None
+        self.track_start_time: float = 0.0
+        self.control_message: Optional[discord.Message] = None
+        self.mixer: Optional[TrackMixer] = None
+        self.pending: Optional[PartialYTDLSource] = None
+        self.skipped: Optional[PartialYTDLSource] = None  # трек, пропущенный командой (для статистики)
 
 class Music(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
         self.queues: Dict[int, MusicQueue] = {}
-        self.current_track: Dict[int, Optional[PartialYTDLSource]] = {}
-        self.track_start_time: Dict[int, float] = {}
-        self.control_messages: Dict[int, discord.Message] = {}
-        self.previous_tracks: Dict[int, List[PartialYTDLSource]] = {}
-        self.cache_cleaner: CacheCleaner = CacheCleaner(CACHE_DIR, MAX_CACHE_SIZE)
-        self.play_next_lock = asyncio.Lock()
+        self.players: Dict[int, GuildPlayback] = {}
+        self.prefetchers: Dict[int, Prefetcher] = {}
+        self.cache_cleaner: CacheCleaner = CacheCleaner(audio_cache)
+        self.progress: ProgressScheduler = ProgressScheduler()
+
+    def get_player(self, guild_id: int) -> GuildPlayback:
+        if guild_id not in self.players:
+            self.players[guild_id] = GuildPlayback(guild_id)
+        return self.players[guild_id]
+
+    def get_queue(self, guild_id: int) -> MusicQueue:
+        if guild_id not in self.queues:
+            self.queues[guild_id] = MusicQueue(guild_id)
+            self.prefetchers[guild_id] = Prefetcher(self.queues[guild_id])
+            self.prefetchers[guild_id].start()
+        return self.queues[guild_id]
+
+    async def drop_queue(self, guild_id: int) -> None:
+        prefetcher = self.prefetchers.pop(guild_id, None)
+        if prefetcher:
+            prefetcher.stop()
+        queue_obj = self.queues.pop(guild_id, None)
+        if queue_obj:
+            await queue_obj.clear()
+            queue_obj.history.close()
+        self._drop_upcoming(guild_id)
+        self.players.pop(guild_id, None)
+        self.progress.cancel(guild_id)
+        track_states.remove(guild_id)
 
     async def cog_load(self) -> None:
+        hot_tier.start()
         self.auto_disconnect_task = asyncio.create_task(self._auto_disconnect_loop())
         self.progress_update_task = asyncio.create_task(self._progress_update_loop())
         self.cleanup_cache_task = asyncio.create_task(self._cleanup_cache_loop())
+        self.analytics_task = asyncio.create_task(self._analytics_flush_loop())
+        if WARMUP_ENABLED:
+            self.warmup_task = asyncio.create_task(self._warmup_loop())
+
+    async def cog_unload(self) -> None:
+        extraction_service.shutdown()
+        normalizer.shutdown()
+        hot_tier.shutdown()
+        await asyncio.to_thread(analytics.flush)
+        await asyncio.to_thread(audio_cache.flush)
 
     async def _auto_disconnect_loop(self) -> None:
         try:
@@ -63,8 +111,8 @@ class Music(commands.Cog):
                     if vc and vc.channel:
                         non_bot = [m for m in vc.channel.members if not m.bot]
                         if not non_bot:
-                            await vc.disconnect()
-                            self.queues.pop(guild.id, None)
+                            await voice_manager.get(guild).disconnect()
+                            await self.drop_queue(guild.id)
                             logger.info("Автоотключение", extra={"guild": guild.name})
                             text_channels = [ch for ch in guild.text_channels if ch.permissions_for(guild.me).send_messages]
                             if text_channels:
@@ -80,124 +128,286 @@ class Music(commands.Cog):
 
     async def _progress_update_loop(self) -> None:
         try:
-            spinner_frames = ["◐", "◓", "◑", "◒"]
-            while not self.bot.is_closed():
-                for guild in self.bot.guilds:
-                    vc = guild.voice_client
-                    if not vc or not vc.is_playing():
-                        continue
-                    track = self.current_track.get(guild.id)
-                    if not track:
-                        continue
-                    duration = track.data.get("duration") or 0
-                    elapsed = time.time() - self.track_start_time.get(guild.id, time.time())
-                    if duration and elapsed > duration:
-                        elapsed = duration
-                    spinner = spinner_frames[int(time.time()) % len(spinner_frames)]
-                    progress_bar = create_progress_bar(elapsed, duration, spinner=spinner)
-                    await track_state.update(track.title, duration, elapsed, self.track_start_time.get(guild.id, time.time()))
-                    if guild.id in self.control_messages:
-                        try:
-                            embed_msg = self.control_messages[guild.id]
-                            embed = embed_msg.embeds[0]
-                            embed.title = f"▶ Сейчас играет: **[{track.title}]({track.data.get('url', '')})**"
-                            embed.description = f"**Длительность:** {format_duration(duration)}"
-                            embed.clear_fields()
-                            embed.add_field(name="Прогресс", value=progress_bar, inline=True)
-                            await embed_msg.edit(embed=embed)
-                        except Exception as e:
-                            logger.error("Ошибка обновления прогресса", extra={"error": str(e)})
-                await asyncio.sleep(2)
+            await self.progress.run(self._render_progress)
         except asyncio.CancelledError:
             logger.info("Задача обновления прогресса завершена")
         except Exception as e:
             logger.error("Ошибка в цикле обновления прогресса", extra={"error": str(e)})
 
+    async def _render_progress(self, guild_id: int) -> Optional[ProgressFrame]:
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        player = self.players.get(guild_id)
+        if not vc or not vc.is_playing() or not player or not player.current_track or not player.control_message:
+            return None
+        track = player.current_track
+        duration = track.data.get("duration") or 0
+        elapsed = time.time() - player.track_start_time
+        if duration and elapsed > duration:
+            elapsed = duration
+        track_states.update(guild_id, track.title, duration, elapsed, player.track_start_time)
+        # Время округляется до шага обновления, а спиннер привязан к делению полосы, чтобы одинаковые кадры сливались
+        step = self.progress.interval_for(guild_id, duration)
+        shown = elapsed - elapsed % step if duration and elapsed < duration else elapsed
+        filled = int(shown / duration * PROGRESS_BAR_LENGTH) if duration else 0
+        spinner = SPINNER_FRAMES[filled % len(SPINNER_FRAMES)]
+        progress_bar = create_progress_bar(shown, duration, length=PROGRESS_BAR_LENGTH, spinner=spinner)
+        embed = player.control_message.embeds[0]
+        embed.title = f"▶ Сейчас играет: **[{track.title}]({track.data.get('url', '')})**"
+        embed.description = f"**Длительность:** {format_duration(duration)}"
+        embed.clear_fields()
+        embed.add_field(name="Прогресс", value=progress_bar, inline=True)
+        return player.control_message, embed, embed.title + progress_bar, duration
+
     async def _cleanup_cache_loop(self) -> None:
         try:
             while not self.bot.is_closed():
                 await self.cache_cleaner.cleanup()
+                await asyncio.to_thread(hot_tier.sweep)
                 await asyncio.sleep(3600)
         except asyncio.CancelledError:
             logger.info("Задача очистки кэша завершена")
         except Exception as e:
             logger.error("Ошибка в цикле очистки кэша", extra={"error": str(e)})
 
+    async def _analytics_flush_loop(self) -> None:
+        try:
+            while not self.bot.is_closed():
+                await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+                await asyncio.to_thread(analytics.flush)
+                await asyncio.to_thread(audio_cache.flush)
+        except asyncio.CancelledError:
+            logger.info("Задача записи статистики завершена")
+        except Exception as e:
+            logger.error("Ошибка в цикле записи статистики", extra={"error": str(e)})
+
+    def playing_guilds(self) -> int:
+        return sum(1 for guild in self.bot.guilds if guild.voice_client and guild.voice_client.is_playing())
+
+    async def _warmup_loop(self) -> None:
+        try:
+            while not self.bot.is_closed():
+                await asyncio.sleep(WARMUP_INTERVAL)
+                if cache_warmer.idle(self.playing_guilds()):
+                    await cache_warmer.run(self.playing_guilds)
+        except asyncio.CancelledError:
+            logger.info("Задача прогрева кэша завершена")
+        except Exception as e:
+            logger.error("Ошибка в цикле прогрева кэша", extra={"error": str(e)})
+
     async def play_next(self, ctx: commands.Context) -> None:
-        async with self.play_next_lock:
-            vc = ctx.voice_client
-            if not vc or not vc.is_connected():
-                logger.debug("Голосовое соединение отсутствует – пытаемся переподключиться.")
-                vc = await ensure_voice_client(ctx)
-                if not vc:
-                    await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось подключиться к голосовому каналу.*", discord.Color.red()))
-                    return
-            guild_id = ctx.guild.id
+        vc = ctx.voice_client
+        if not vc or not vc.is_connected():
+            logger.debug("Голосовое соединение отсутствует – пытаемся переподключиться.")
+            vc = await ensure_voice_client(ctx)
+            if not vc:
+                await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось подключиться к голосовому каналу.*", discord.Color.red()))
+                return
+        guild_id = ctx.guild.id
+        player = self.get_player(guild_id)
+        # Под блокировкой сервера – только смена трека; сеть (подключение, сообщения) вне критической секции
+        async with player.lock:
+            if vc.is_playing() or vc.is_paused():
+                return
             queue_obj = self.queues.get(guild_id)
             if not queue_obj:
-                self.current_track.pop(guild_id, None)
+                player.current_track = None
                 return
-            track = await queue_obj.get_next_track()
+            # Трек, подготовленный для микшера, который успел доиграть раньше
+            track, player.pending = player.pending, None
+            if track is None:
+                track = await queue_obj.get_next_track()
             if not track:
                 return
-            self.previous_tracks.setdefault(guild_id, [])
-            if guild_id in self.current_track and self.current_track[guild_id] is not None:
-                prev = self.current_track[guild_id]
-                self.previous_tracks[guild_id].append(prev)
-                if len(self.previous_tracks[guild_id]) > 50:
-                    self.previous_tracks[guild_id].pop(0)
-            self.current_track[guild_id] = track
-            self.track_start_time[guild_id] = time.time()
-            await track_state.update(track.title, track.data.get("duration") or 0, 0, self.track_start_time[guild_id])
-            def after_playing(error: Optional[Exception]) -> None:
-                if error:
-                    logger.error("Ошибка воспроизведения", extra={"error": str(error)})
+            self._set_current(player, track)
+            if not self._start_track(ctx, vc, track):
+                player.current_track = None
+                asyncio.create_task(ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось запустить трек. Проверьте установку FFmpeg.*", discord.Color.red())))
+                return
+        await self._announce(ctx, player, track)
+
+    def _set_current(self, player: GuildPlayback, track: PartialYTDLSource) -> None:
+        player.current_track = track
+        player.track_start_time = time.time() - track.position
+        analytics.record_play(player.guild_id, track.url, track.title)
+
+    async def _announce(self, ctx: commands.Context, player: GuildPlayback, track: PartialYTDLSource) -> None:
+        guild_id = ctx.guild.id
+        duration = track.data.get("duration") or 0
+        track_states.update(guild_id, track.title, duration, 0, player.track_start_time)
+        emb = create_embed("▶ Сейчас играет", f"**[{track.title}]({track.data.get('url', '')})**", discord.Color.blurple(), thumbnail=track.thumbnail, title_url=track.data.get("url"))
+        emb.add_field(name="Длительность", value=format_duration(duration), inline=True)
+        emb.add_field(name="Прогресс", value=create_progress_bar(0, duration), inline=True)
+        msg = await ctx.send(embed=emb, view=ControlView(self, ctx))
+        player.control_message = msg
+        self.progress.schedule(guild_id, self.progress.interval_for(guild_id, duration))
+
+    def _start_track(self, ctx: commands.Context, vc: discord.VoiceClient, track: PartialYTDLSource,
+                     pending: List[PartialYTDLSource] = ()) -> bool:
+        """Запускает микшер с треком; дальнейшие треки он переключает сам, без нового vc.play."""
+        loop = asyncio.get_running_loop()
+        mixer = TrackMixer(
+            track,
+            on_change=lambda old, new: loop.call_soon_threadsafe(self._on_track_change, ctx, old, new),
+            on_need_next=(lambda: loop.call_soon_threadsafe(self._request_next, ctx, mixer)) if GAPLESS_PLAYBACK else None)
+        for item in pending:
+            mixer.enqueue(item)
+        def after_playing(error: Optional[Exception]) -> None:
+            # Поток плеера ничего не ждёт: забирает треки у микшера и переносит обработку в цикл событий
+            current, rest = mixer.detach()
+            loop.call_soon_threadsafe(self._on_track_end, ctx, current, rest, error)
+        try:
+            track.open()
+            vc.play(mixer, after=after_playing)
+        except Exception as e:
+            logger.error("Ошибка запуска трека", extra={"error": str(e)})
+            mixer.detach()
+            return False
+        self.get_player(ctx.guild.id).mixer = mixer
+        return True
+
+    def _request_next(self, ctx: commands.Context, mixer: TrackMixer) -> None:
+        asyncio.create_task(self._preload_next(ctx, mixer))
+
+    async def _preload_next(self, ctx: commands.Context, mixer: TrackMixer) -> None:
+        """Готовит следующий трек очереди для бесшовного перехода, пока текущий доигрывает."""
+        player = self.players.get(ctx.guild.id)
+        queue_obj = self.queues.get(ctx.guild.id)
+        if not player or not queue_obj:
+            return
+        async with player.lock:
+            if player.mixer is not mixer or player.pending is not None:
+                return
+            track = await queue_obj.get_next_track()
+            if track is None:
+                return
+            # Повтор того же трека: он ещё играет, открывать второй FFmpeg нельзя – микшер перемотает его сам
+            if track is not player.current_track:
                 try:
-                    track.cleanup_file()
+                    track.open()
                 except Exception as e:
-                    logger.error("Ошибка очистки файла", extra={"file": track.file_path, "error": str(e)})
-                if ctx.voice_client and ctx.voice_client.is_connected() and GLOBAL_DISCORD_LOOP:
-                    asyncio.run_coroutine_threadsafe(self.play_next(ctx), GLOBAL_DISCORD_LOOP)
-                else:
-                    logger.warning("Голосовое соединение отсутствует, пытаюсь переподключиться...")
+                    logger.error("Ошибка запуска трека", extra={"error": str(e)})
+                    track.discard()
+                    return
+            if not mixer.enqueue(track):
+                # Текущий трек закончился раньше – трек запустит play_next после остановки микшера
+                player.pending = track
+
+    def _on_track_change(self, ctx: commands.Context, old: PartialYTDLSource, new: PartialYTDLSource) -> None:
+        # При повторе old и new – один объект, уже перемотанный микшером: завершать его нельзя
+        if old is not new:
+            self._finish_track(ctx.guild.id, old)
+        player = self.players.get(ctx.guild.id)
+        if player:
+            self._set_current(player, new)
+            asyncio.create_task(self._announce(ctx, player, new))
+
+    def _finish_track(self, guild_id: int, track: PartialYTDLSource) -> None:
+        player = self.players.get(guild_id)
+        analytics.record_finish(guild_id, track.url, track.position, skipped=bool(player and player.skipped is track))
+        queue_obj = self.queues.get(guild_id)
+        if queue_obj and queue_obj.contains(track):
+            # Повтор всей очереди: тот же объект сыграет снова – закрываем только FFmpeg, файл и загрузку не трогаем
+            track.cleanup()
+            return
+        # Пропуск или остановка: недокачанный трек больше не нужен – останавливаем его загрузку
+        track.release_download()
+        track.cleanup()
+        try:
+            track.cleanup_file()
+        except Exception as e:
+            logger.error("Ошибка очистки файла", extra={"file": track.file_path, "error": str(e)})
+
+    def _drop_upcoming(self, guild_id: int) -> None:
+        """Очистка очереди: треки, уже подготовленные микшером, тоже не должны заиграть."""
+        player = self.players.get(guild_id)
+        if not player:
+            return
+        dropped = player.mixer.drop_upcoming() if player.mixer else []
+        if player.pending is not None:
+            dropped.append(player.pending)
+            player.pending = None
+        for track in dropped:
+            if track is not player.current_track:
+                track.discard()
+
+    def _skip_current(self, guild_id: int, vc: discord.VoiceClient) -> None:
+        player = self.players.get(guild_id)
+        if player:
+            player.skipped = player.current_track
+        if not (player and player.mixer and player.mixer.skip()):
+            vc.stop()
+
+    def _on_track_end(self, ctx: commands.Context, track: Optional[PartialYTDLSource], rest: List[PartialYTDLSource],
+                      error: Optional[Exception]) -> None:
+        if error:
+            logger.error("Ошибка воспроизведения", extra={"error": str(error)})
+        player = self.players.get(ctx.guild.id)
+        # Трек прервала потеря голосового соединения, а не пропуск – продолжаем его после переподключения
+        if track and player and player.current_track is track and voice_manager.get(ctx.guild).lost():
+            asyncio.create_task(self._resume_after_reconnect(ctx, track, rest))
+            return
+        # !leave или автоотключение: плеер остановлен вместе с соединением, следующий трек не запускаем
+        closed = voice_manager.get(ctx.guild).state == VOICE_CLOSED
+        if track and player and player.pending is track and not closed:
+            track.cleanup()  # повтор того же трека после остановки микшера: play_next откроет его заново
+        elif track:
+            self._finish_track(ctx.guild.id, track)
+        # Микшер остановлен извне (стоп, отключение) – подготовленные треки не играют
+        for item in rest:
+            if item is not track:
+                item.discard()
+        if player and not closed:
+            asyncio.create_task(self.play_next(ctx))
+
+    async def _resume_after_reconnect(self, ctx: commands.Context, track: PartialYTDLSource,
+                                      rest: List[PartialYTDLSource]) -> None:
+        position = track.position
+        logger.warning("Голосовое соединение потеряно, переподключаюсь", extra={"guild": ctx.guild.id, "position": round(position, 1)})
+        vc = await voice_manager.get(ctx.guild).reconnect()
+        player = self.players.get(ctx.guild.id)
+        if vc and player:
+            async with player.lock:
+                if player.current_track is track and not vc.is_playing() and not vc.is_paused():
                     try:
-                        fut = asyncio.run_coroutine_threadsafe(ensure_voice_client(ctx), GLOBAL_DISCORD_LOOP)
-                        new_vc = fut.result(timeout=10)
-                        if new_vc and new_vc.is_connected():
-                            logger.info("Голосовое соединение восстановлено")
-                            asyncio.run_coroutine_threadsafe(self.play_next(ctx), GLOBAL_DISCORD_LOOP)
-                        else:
-                            logger.error("Не удалось переподключиться к голосовому каналу")
+                        track.seek(position)
+                        resumed = self._start_track(ctx, vc, track, rest)
                     except Exception as e:
-                        logger.exception("Ошибка при переподключении", extra={"error": str(e)})
-            try:
-                vc.play(track, after=after_playing)
-            except Exception as e:
-                logger.error("Ошибка запуска трека", extra={"error": str(e)})
-                asyncio.create_task(ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось запустить трек. Проверьте установку FFmpeg.*", discord.Color.red())))
-                return
-            duration = track.data.get("duration") or 0
-            emb = create_embed("▶ Сейчас играет", f"**[{track.title}]({track.data.get('url', '')})**", discord.Color.blurple(), thumbnail=track.thumbnail, title_url=track.data.get("url"))
-            emb.add_field(name="Длительность", value=format_duration(duration), inline=True)
-            emb.add_field(name="Прогресс", value=create_progress_bar(0, duration), inline=True)
-            msg = await ctx.send(embed=emb, view=ControlView(self, ctx))
-            self.control_messages[guild_id] = msg
+                        logger.error("Ошибка перезапуска трека", extra={"error": str(e)})
+                        resumed = False
+                    if resumed:
+                        player.track_start_time = time.time() - position
+                        logger.info("Голосовое соединение восстановлено", extra={"guild": ctx.guild.id, "position": round(position, 1)})
+                        return
+                    player.current_track = None
+        else:
+            logger.error("Не удалось переподключиться к голосовому каналу", extra={"guild": ctx.guild.id})
+            if player and player.current_track is track:
+                player.current_track = None
+        self._finish_track(ctx.guild.id, track)
+        for item in rest:
+            if item is not track:
+                item.discard()
+        if vc and player:
+            asyncio.create_task(self.play_next(ctx))
 
     @commands.command(name="list")
     async def list_tracks(self, ctx: commands.Context) -> None:
         guild_id = ctx.guild.id
         msg = ""
         num = 1
-        if guild_id in self.current_track and self.current_track[guild_id] is not None:
-            msg += f"**Сейчас играет:** _{self.current_track[guild_id].title}_\n\n"
+        player = self.players.get(guild_id)
+        if player and player.current_track is not None:
+            msg += f"**Сейчас играет:** _{player.current_track.title}_\n\n"
         queue_obj = self.queues.get(guild_id)
-        if queue_obj:
-            items = list(queue_obj.queue._queue)
-            if items:
-                msg += "**Очередь:**\n"
-                for track in items:
-                    msg += f"{num}. {track.title}\n"
-                    num += 1
+        if queue_obj and len(queue_obj.queue):
+            msg += "**Очередь:**\n"
+            for track in queue_obj.upcoming(LIST_PAGE_SIZE):
+                msg += f"{num}. {track.title}\n"
+                num += 1
+            rest = len(queue_obj.queue) - LIST_PAGE_SIZE
+            if rest > 0:
+                msg += f"_...и ещё {rest}_\n"
         if not msg:
             msg = "Очередь пуста."
         await ctx.send(embed=create_embed("Очередь треков", msg, discord.Color.blue()))
@@ -206,8 +416,8 @@ class Music(commands.Cog):
     async def leave(self, ctx: commands.Context) -> None:
         vc = ctx.voice_client
         if vc:
-            await vc.disconnect()
-            self.queues.pop(ctx.guild.id, None)
+            await voice_manager.get(ctx.guild).disconnect()
+            await self.drop_queue(ctx.guild.id)
             await ctx.send(embed=create_embed("Отключение", "*Отключился от канала.*", discord.Color.red()))
         else:
             await ctx.send(embed=create_embed("❌ Ошибка", "*Я не в голосовом канале.*", discord.Color.red()))
@@ -226,25 +436,15 @@ class Music(commands.Cog):
         if "list=" in query:
             await ctx.send(embed=create_embed("Плейлист", "*Начинаю загрузку плейлиста...*", discord.Color.blurple()))
             try:
-                info = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(ytdl_format_options).extract_info(query, download=False))
-                if 'entries' not in info:
+                info = await extract_info_cached(query, ytdl_playlist_options)
+                if not info or 'entries' not in info:
                     raise Exception("Плейлист не найден.")
-                entries = info['entries'][:10]
-                async def load_track(entry: Dict[str, Any]) -> Optional[PartialYTDLSource]:
-                    url = entry.get("webpage_url")
-                    try:
-                        return await PartialYTDLSource.create_partial(url)
-                    except Exception as e:
-                        logger.error("Ошибка загрузки трека", extra={"error": str(e)})
-                        return None
-                tracks_raw = await asyncio.gather(*(load_track(entry) for entry in entries))
-                tracks = [t for t in tracks_raw if t is not None]
+                entries = list(info['entries'] or [])[:PLAYLIST_MAX_ENTRIES]
+                tracks = [t for t in (LazyTrack.from_flat_entry(entry, ctx.guild.id) for entry in entries if entry) if t is not None]
                 if not tracks:
                     await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось загрузить треки.*", discord.Color.red()))
                     return
-                if ctx.guild.id not in self.queues:
-                    self.queues[ctx.guild.id] = MusicQueue()
-                await self.queues[ctx.guild.id].add_tracks(tracks)
+                await self.get_queue(ctx.guild.id).add_tracks(tracks)
                 await ctx.send(embed=create_embed("✅ Добавлено", f"*Добавлено {len(tracks)} треков в очередь.*", discord.Color.green()))
                 if not vc.is_playing():
                     await self.play_next(ctx)
@@ -252,27 +452,27 @@ class Music(commands.Cog):
                 logger.error("Ошибка плейлиста", extra={"error": str(e)})
                 await ctx.send(embed=create_embed("❌ Ошибка", f"*{e}*", discord.Color.red()))
             return
+        search_text = query
         if not query.startswith("http"):
-            search_query = f"ytsearch5:{query}"
             await ctx.send(embed=create_embed("Поиск", f"*Ищу: **{query}***", discord.Color.blurple()))
             try:
-                info = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(ytdl_format_options).extract_info(search_query, download=False))
-                results = info.get("entries", [])
-                if not results:
+                result = await search_service.top(query)
+                if not result:
                     raise Exception("Ничего не найдено.")
             except Exception as e:
                 logger.error("Ошибка поиска", extra={"error": str(e)})
                 await ctx.send(embed=create_embed("❌ Ошибка", f"*{e}*", discord.Color.red()))
                 return
-            query = results[0]["webpage_url"]
+            query = result["webpage_url"]
         async with ctx.typing():
             try:
-                partial_source = await PartialYTDLSource.create_partial(query)
+                partial_source = await PartialYTDLSource.create_partial(
+                    query, request=DownloadRequest(PRIORITY_INTERACTIVE, ctx.guild.id))
             except Exception as e:
                 err_text = str(e).lower()
                 if any(keyword in err_text for keyword in ["block", "geo", "nonetype", "unavailable", "недоступно", "не удалось получить локальный файл"]):
                     await ctx.send(embed=create_embed("Альтернативные варианты", "*Данный трек недоступен в вашем регионе. Ищу альтернативы...*", discord.Color.orange()))
-                    alternatives = await find_alternative_tracks(query)
+                    alternatives = await find_alternative_tracks(search_text)
                     if not alternatives:
                         await ctx.send(embed=create_embed("❌ Ошибка", "*Не удалось найти альтернативные варианты.*", discord.Color.red()))
                         return
@@ -294,16 +494,15 @@ class Music(commands.Cog):
                         await ctx.send(embed=create_embed("Отмена", "*Время ожидания ответа истекло. Альтернативный поиск отменён.*", discord.Color.orange()))
                         return
                     try:
-                        partial_source = await PartialYTDLSource.create_partial(query)
+                        partial_source = await PartialYTDLSource.create_partial(
+                            query, request=DownloadRequest(PRIORITY_INTERACTIVE, ctx.guild.id))
                     except Exception as e2:
                         await ctx.send(embed=create_embed("❌ Ошибка", f"*Ошибка загрузки альтернативы: {e2}*", discord.Color.red()))
                         return
                 else:
                     await ctx.send(embed=create_embed("❌ Ошибка", f"*Ошибка загрузки: {e}\nСовет: проверьте установку FFmpeg.*", discord.Color.red()))
                     return
-        if ctx.guild.id not in self.queues:
-            self.queues[ctx.guild.id] = MusicQueue()
-        await self.queues[ctx.guild.id].add_track(partial_source)
+        await self.get_queue(ctx.guild.id).add_track(partial_source)
         await ctx.send(embed=create_embed("✅ Добавлено", f"*[{partial_source.title}]({partial_source.data.get('url', '')})* добавлен в очередь.", discord.Color.green(), thumbnail=partial_source.thumbnail))
         if not vc.is_playing():
             await self.play_next(ctx)
@@ -324,6 +523,7 @@ class Music(commands.Cog):
             await ctx.send(embed=create_embed("❌ Ошибка", "*Нет трека на паузе.*", discord.Color.red()))
         else:
             vc.resume()
+            self.progress.schedule(ctx.guild.id)
             await ctx.send(embed=create_embed("ℹ️ Возобновление", "*Воспроизведение возобновлено.*", discord.Color.blue()))
 
     @commands.command(name="skip")
@@ -332,13 +532,13 @@ class Music(commands.Cog):
         if not vc or not vc.is_playing():
             await ctx.send(embed=create_embed("❌ Ошибка", "*Ничего не воспроизводится.*", discord.Color.red()))
         else:
-            vc.stop()
+            self._skip_current(ctx.guild.id, vc)
             await ctx.send(embed=create_embed("ℹ️ Пропустить", "*Трек пропущен.*", discord.Color.blue()))
 
     @commands.command(name="remove")
     async def remove(self, ctx: commands.Context, index: int) -> None:
         guild_id = ctx.guild.id
-        if guild_id not in self.queues or self.queues[guild_id].queue.empty():
+        if guild_id not in self.queues or not len(self.queues[guild_id].queue):
             await ctx.send(embed=create_embed("❌ Ошибка", "*Очередь пуста.*", discord.Color.red()))
             return
         removed_track = await self.queues[guild_id].remove(index - 1)
@@ -347,10 +547,23 @@ class Music(commands.Cog):
         else:
             await ctx.send(embed=create_embed("🗑️ Удалено", f"*{removed_track.title}* удалён из очереди.", discord.Color.orange()))
 
+    @commands.command(name="move")
+    async def move(self, ctx: commands.Context, src: int, dst: int) -> None:
+        guild_id = ctx.guild.id
+        if guild_id not in self.queues or not len(self.queues[guild_id].queue):
+            await ctx.send(embed=create_embed("❌ Ошибка", "*Очередь пуста.*", discord.Color.red()))
+            return
+        if not await self.queues[guild_id].move(src - 1, dst - 1):
+            await ctx.send(embed=create_embed("❌ Ошибка", "*Неверный номер трека.*", discord.Color.red()))
+        else:
+            track = self.queues[guild_id].queue[dst - 1]
+            await ctx.send(embed=create_embed("↕️ Перемещено", f"*{track.title}* теперь на позиции {dst}.", discord.Color.blue()))
+
     @commands.command(name="clear")
     async def clear(self, ctx: commands.Context) -> None:
         if ctx.guild.id in self.queues:
             await self.queues[ctx.guild.id].clear()
+            self._drop_upcoming(ctx.guild.id)
             await ctx.send(embed=create_embed("⚠️ Очистка очереди", "*Очередь очищена.*", discord.Color.green()))
         else:
             await ctx.send(embed=create_embed("❌ Ошибка", "*Очередь пуста.*", discord.Color.red()))
@@ -359,6 +572,7 @@ class Music(commands.Cog):
     async def stop(self, ctx: commands.Context) -> None:
         vc = ctx.voice_client
         if vc:
+            self._drop_upcoming(ctx.guild.id)
             vc.stop()
             if ctx.guild.id in self.queues:
                 await self.queues[ctx.guild.id].clear()
@@ -368,25 +582,31 @@ class Music(commands.Cog):
 
     @commands.command(name="history")
     async def history(self, ctx: commands.Context) -> None:
-        if ctx.guild.id in self.queues and self.queues[ctx.guild.id].history:
-            hist = "\n".join(f"{item['title']} ({time.strftime('%H:%M:%S', time.gmtime(item['played_at']))})" for item in self.queues[ctx.guild.id].history[-10:])
+        if ctx.guild.id in self.queues and len(self.queues[ctx.guild.id].history):
+            hist = "\n".join(f"{item.title} ({time.strftime('%H:%M:%S', time.gmtime(item.played_at))})" for item in self.queues[ctx.guild.id].history.recent(10))
             await ctx.send(embed=create_embed("⚠️ История треков", hist, discord.Color.blue()))
         else:
             await ctx.send(embed=create_embed("⚠️ История треков", "*История пуста.*", discord.Color.orange()))
 
     @commands.command(name="stats")
     async def stats(self, ctx: commands.Context) -> None:
-        if ctx.guild.id in self.queues:
-            played = self.queues[ctx.guild.id].stats
-            await ctx.send(embed=create_embed("ℹ️ Статистика", f"*Сыграно треков: {played}*", discord.Color.blue()))
-        else:
+        stats = analytics.get_stats(ctx.guild.id)
+        if not stats["plays"]:
             await ctx.send(embed=create_embed("ℹ️ Статистика", "*Нет статистики для данного сервера.*", discord.Color.orange()))
+            return
+        top = await asyncio.to_thread(analytics.top_tracks, 5, ctx.guild.id)
+        msg = (f"*Сыграно треков: {stats['plays']}*\n*Пропущено: {stats['skips']}*\n"
+               f"*Прослушано: {stats['listened_hours']} ч*\n*Среднее ожидание загрузки: {stats['avg_download_latency']} с*")
+        if top:
+            msg += "\n\n**Чаще всего:**\n" + "\n".join(f"{i}. {t['title']} ({t['plays']})" for i, t in enumerate(top, start=1))
+        await ctx.send(embed=create_embed("ℹ️ Статистика", msg, discord.Color.blue()))
 
     @commands.command(name="control")
     async def control(self, ctx: commands.Context) -> None:
         emb = create_embed("Панель управления", "*Информация о текущем треке будет обновляться автоматически.*", discord.Color.blurple())
         msg = await ctx.send(embed=emb, view=ControlView(self, ctx))
-        self.control_messages[ctx.guild.id] = msg
+        self.get_player(ctx.guild.id).control_message = msg
+        self.progress.schedule(ctx.guild.id)
 
     @commands.command(name="helps")
     async def help_command(self, ctx: commands.Context) -> None:
@@ -398,6 +618,7 @@ class Music(commands.Cog):
             ("!skip", "Пропустить трек"),
             ("!list", "Посмотреть номер треков"),
             ("!remove <номер>", "Удалить трек из очереди"),
+            ("!move <откуда> <куда>", "Переместить трек в очереди"),
             ("!clear", "Очистить очередь"),
             ("!stop", "Остановить воспроизведение"),
             ("!history", "Показать историю воспроизведения"),
@@ -411,11 +632,18 @@ class Music(commands.Cog):
         await ctx.send(embed=embed)
 
     async def get_overall_stats(self) -> Dict[str, Any]:
-        total = sum(queue.stats for queue in self.queues.values())
-        return {"total_tracks": total}
+        return {"total_tracks": int(analytics.counter("plays")), "analytics": analytics.get_stats(),
+                "progress": self.progress.get_stats(), "extraction": extraction_service.get_stats(),
+                "normalizer": normalizer.get_stats(), "downloads": downloads.get_stats(),
+                "voice": voice_manager.get_stats(),
+                "scheduler": download_scheduler.get_stats(), "search": search_service.get_stats(),
+                "warmup": cache_warmer.get_stats(), "cache": audio_cache.get_stats(), "hot_cache": hot_tier.get_stats()}
+
+    def get_now_playing(self) -> Dict[int, Dict[str, Any]]:
+        return track_states.snapshot()
 
     async def get_queue_state(self) -> Dict[int, List[str]]:
-        return {gid: [track.title for track in q.queue._queue] for gid, q in self.queues.items()}
+        return {gid: [track.title for track in q.queue] for gid, q in self.queues.items()}
 
 class ControlView(discord.ui.View):
     def __init__(self, cog: Music, ctx: commands.Context) -> None:
@@ -436,6 +664,7 @@ class ControlView(discord.ui.View):
             await interaction.followup.send("Воспроизведение приостановлено.", ephemeral=True)
         elif vc.is_paused():
             vc.resume()
+            self.cog.progress.schedule(self.ctx.guild.id)
             button.label = "⏸ Пауза"
             await interaction.response.edit_message(view=self)
             await interaction.followup.send("Воспроизведение возобновлено.", ephemeral=True)
@@ -448,7 +677,7 @@ class ControlView(discord.ui.View):
         if not vc or not vc.is_playing():
             await interaction.response.send_message("Ничего не воспроизводится.", ephemeral=True)
         else:
-            vc.stop()
+            self.cog._skip_current(self.ctx.guild.id, vc)
             await interaction.response.send_message("Трек пропущен.", ephemeral=True)
 
     @discord.ui.button(label="🔁 Повтор: none", style=discord.ButtonStyle.success)
@@ -478,6 +707,7 @@ class ControlView(discord.ui.View):
         guild_id = self.ctx.guild.id
         if guild_id in self.cog.queues:
             await self.cog.queues[guild_id].clear()
+            self.cog._drop_upcoming(guild_id)
             await interaction.response.send_message("Очередь очищена.", ephemeral=True)
         else:
             await interaction.response.send_message("Очередь пуста.", ephemeral=True)
@@ -486,6 +716,7 @@ class ControlView(discord.ui.View):
     async def stop(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
         vc = self.ctx.voice_client
         if vc:
+            self.cog._drop_upcoming(self.ctx.guild.id)
             vc.stop()
             if self.ctx.guild.id in self.cog.queues:
                 await self.cog.queues[self.ctx.guild.id].clear()
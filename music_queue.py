@@ -1,130 +1,279 @@
 import time
 import asyncio
 import random
-import os
-from typing import Dict, List, Optional, Any, Tuple
+import itertools
+from typing import Dict, List, Optional, Any, Union, Iterator
 from downloader import PartialYTDLSource
+from download_scheduler import DownloadRequest, PRIORITY_NEXT_UP, PRIORITY_PREFETCH, PRIORITY_BULK
+from audio_cache import AudioCache
+from history import PlayHistory
 from logging_config import logger
 
 class TrackState:
+    """Неизменяемая после создания запись о треке сервера: обновление заменяет запись целиком."""
+    __slots__ = ("guild_id", "title", "duration", "progress", "start_time", "updated_at")
+
+    def __init__(self, guild_id: int, title: str, duration: float, progress: float, start_time: float) -> None:
+        self.guild_id = guild_id
+        self.title = title
+        self.duration = duration
+        self.progress = progress
+        self.start_time = start_time
+        self.updated_at = time.time()
+
+    def as_dict(self, now: Optional[float] = None) -> Dict[str, Any]:
+        progress = self.progress
+        if self.start_time:
+            progress = (now or time.time()) - self.start_time
+            if self.duration:
+                progress = min(progress, self.duration)
+        return {
+            "guild_id": self.guild_id,
+            "title": self.title,
+            "progress": progress,
+            "duration": self.duration,
+            "start_time": self.start_time
+        }
+
+class TrackStateRegistry:
+    """Реестр состояний по серверам без блокировок: запись – атомарная замена ссылки в словаре."""
     def __init__(self) -> None:
-        self.title: str = "Нет трека"
-        self.progress: float = 0.0
-        self.duration: float = 0.0
-        self.start_time: float = 0.0
-        self.lock = asyncio.Lock()
-
-    async def update(self, title: str, duration: float, progress: float, start_time: float) -> None:
-        async with self.lock:
-            self.title = title
-            self.duration = duration
-            self.progress = progress
-            self.start_time = start_time
-
-    async def get_state(self) -> Dict[str, Any]:
-        async with self.lock:
-            return {
-                "title": self.title,
-                "progress": self.progress,
-                "duration": self.duration,
-                "start_time": self.start_time
-            }
-
-# Глобальный объект для отслеживания состояния трека
-track_state = TrackState()
+        self._states: Dict[int, TrackState] = {}
 
-class MusicQueue:
+    def update(self, guild_id: int, title: str, duration: float, progress: float, start_time: float) -> None:
+        self._states[guild_id] = TrackState(guild_id, title, duration, progress, start_time)
+
+    def remove(self, guild_id: int) -> None:
+        self._states.pop(guild_id, None)
+
+    def get_state(self, guild_id: int) -> Optional[Dict[str, Any]]:
+        state = self._states.get(guild_id)
+        return state.as_dict() if state else None
+
+    def snapshot(self) -> Dict[int, Dict[str, Any]]:
+        # dict.copy() выполняется атомарно под GIL, поэтому снимок согласован для всех серверов сразу
+        states = self._states.copy()
+        now = time.time()
+        return {guild_id: state.as_dict(now) for guild_id, state in states.items()}
+
+# Глобальный реестр состояния треков по серверам
+track_states = TrackStateRegistry()
+
+class LazyTrack:
+    """Элемент очереди плейлиста: хранит только URL и плоские метаданные до момента загрузки."""
+    def __init__(self, url: str, data: Optional[Dict[str, Any]] = None, guild_id: Optional[int] = None) -> None:
+        self.url: str = url
+        self.data: Dict[str, Any] = data or {}
+        self.title: str = self.data.get("title") or url
+        self.thumbnail: Optional[str] = self.data.get("thumbnail")
+        self.resolve_task: Optional[asyncio.Task] = None
+        # Заявка живёт вместе с треком: приоритет повышается, когда трек приближается к началу очереди
+        self.request: DownloadRequest = DownloadRequest(PRIORITY_BULK, guild_id)
+
+    @classmethod
+    def from_flat_entry(cls, entry: Dict[str, Any], guild_id: Optional[int] = None) -> Optional["LazyTrack"]:
+        url = entry.get("webpage_url") or entry.get("url")
+        if not url:
+            return None
+        thumbnails = entry.get("thumbnails") or []
+        data = {
+            "title": entry.get("title"),
+            "url": url,
+            "thumbnail": entry.get("thumbnail") or (thumbnails[-1].get("url") if thumbnails else None),
+            "duration": entry.get("duration"),
+        }
+        return cls(url, data, guild_id)
+
+    def start_resolving(self, priority: int = PRIORITY_PREFETCH) -> None:
+        self.request.promote(priority)
+        if self.resolve_task is None:
+            self.resolve_task = asyncio.create_task(PartialYTDLSource.create_partial(self.url, request=self.request))
+
+    def estimated_size(self, bytes_per_second: int) -> int:
+        return int((self.data.get("duration") or 300) * bytes_per_second)
+
+    async def resolve(self) -> PartialYTDLSource:
+        self.start_resolving(PRIORITY_NEXT_UP)
+        task = self.resolve_task
+        self.resolve_task = None
+        return await task
+
+    def discard(self) -> None:
+        task, self.resolve_task = self.resolve_task, None
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            task.result().discard()
+
+QueueItem = Union[PartialYTDLSource, LazyTrack]
+
+class TrackQueue:
+    """Очередь на списке со смещением головы: O(1) добавление, извлечение из начала и доступ по индексу.
+
+    Вставка, удаление и перемещение по позиции сводятся к одному memmove списка, без перекладывания элементов
+    через await, поэтому очереди из десятков тысяч треков не блокируют событийный цикл.
+    """
     def __init__(self) -> None:
-        self.queue: asyncio.Queue[PartialYTDLSource] = asyncio.Queue()
-        self.history: List[Dict[str, Any]] = []
-        self.stats: int = 0
+        self._items: List[QueueItem] = []
+        self._head: int = 0
+        self.not_empty: asyncio.Event = asyncio.Event()
+        self.changed: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items) - self._head
+
+    def __iter__(self) -> Iterator[QueueItem]:
+        return itertools.islice(self._items, self._head, None)
+
+    def __getitem__(self, index: int) -> QueueItem:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._items[self._head + index]
+
+    def _touch(self) -> None:
+        if len(self):
+            self.not_empty.set()
+        else:
+            self.not_empty.clear()
+        self.changed.set()
+
+    def _compact(self) -> None:
+        # Сдвигаем список только когда «мёртвая» голова заметна – амортизированно O(1) на извлечение
+        if self._head > 1024 and self._head * 2 > len(self._items):
+            del self._items[:self._head]
+            self._head = 0
+
+    def peek(self, count: int) -> List[QueueItem]:
+        return self._items[self._head:self._head + count]
+
+    def append(self, item: QueueItem) -> None:
+        self._items.append(item)
+        self._touch()
+
+    def extend(self, items: List[QueueItem]) -> None:
+        self._items.extend(items)
+        self._touch()
+
+    def popleft(self) -> Optional[QueueItem]:
+        if not len(self):
+            return None
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        self._compact()
+        self._touch()
+        return item
+
+    async def get(self) -> QueueItem:
+        while not len(self):
+            await self.not_empty.wait()
+        return self.popleft()
+
+    def insert(self, index: int, item: QueueItem) -> None:
+        index = min(max(index, 0), len(self))
+        self._items.insert(self._head + index, item)
+        self._touch()
+
+    def remove(self, index: int) -> Optional[QueueItem]:
+        if not 0 <= index < len(self):
+            return None
+        item = self._items.pop(self._head + index)
+        self._touch()
+        return item
+
+    def move(self, src: int, dst: int) -> bool:
+        if not 0 <= src < len(self) or not 0 <= dst < len(self):
+            return False
+        self._items.insert(self._head + dst, self._items.pop(self._head + src))
+        self._touch()
+        return True
+
+    def shuffle(self) -> None:
+        del self._items[:self._head]
+        self._head = 0
+        random.shuffle(self._items)
+        self._touch()
+
+    def clear(self) -> List[QueueItem]:
+        items = self._items[self._head:]
+        self._items = []
+        self._head = 0
+        self._touch()
+        return items
+
+class MusicQueue:
+    def __init__(self, guild_id: Optional[int] = None) -> None:
+        self.queue: TrackQueue = TrackQueue()
+        self.history: PlayHistory = PlayHistory.for_guild(guild_id)
         self.loop_mode: str = "none"
+        # Текущий трек: в режимах повтора он же лежит в очереди, и удаление из очереди не должно его закрывать
+        self.current: Optional[PartialYTDLSource] = None
+        # Сигнал для Prefetcher: состав или порядок очереди изменился
+        self.changed: asyncio.Event = self.queue.changed
 
-    async def add_track(self, track: PartialYTDLSource) -> None:
-        await self.queue.put(track)
+    def upcoming(self, count: int) -> List[QueueItem]:
+        return self.queue.peek(count)
 
-    async def add_tracks(self, tracks: List[PartialYTDLSource]) -> None:
-        for track in tracks:
-            await self.queue.put(track)
+    def contains(self, track: PartialYTDLSource) -> bool:
+        """Трек ещё стоит в очереди (режим повтора) и сыграет снова."""
+        return any(item is track for item in self.queue)
+
+    async def add_track(self, track: QueueItem) -> None:
+        self.queue.append(track)
+
+    async def add_tracks(self, tracks: List[QueueItem]) -> None:
+        self.queue.extend(tracks)
 
     async def get_next_track(self) -> Optional[PartialYTDLSource]:
-        if self.queue.empty():
-            return None
-        track = await self.queue.get()
-        if self.loop_mode in ("single", "all"):
-            await self.queue.put(track)
-        self.history.append({"title": track.title, "played_at": time.time()})
-        self.stats += 1
-        return track
+        while len(self.queue):
+            item = self.queue.popleft()
+            if isinstance(item, LazyTrack):
+                try:
+                    track = await item.resolve()
+                except Exception as e:
+                    # Незагрузившийся трек в очередь не возвращается даже при повторе – иначе очередь
+                    # из одних недоступных видео перебиралась бы бесконечно
+                    logger.error("Ошибка загрузки трека из плейлиста", extra={"url": item.url, "error": str(e)})
+                    continue
+            else:
+                track = item
+            if self.loop_mode in ("single", "all"):
+                self.queue.append(track)
+            self.current = track
+            self.history.append(track.url, track.title)
+            return track
+        return None
 
     async def clear(self) -> None:
-        while not self.queue.empty():
-            await self.queue.get()
+        for item in self.queue.clear():
+            if item is not self.current:
+                item.discard()
 
     async def shuffle(self) -> None:
-        items: List[PartialYTDLSource] = []
-        while not self.queue.empty():
-            items.append(await self.queue.get())
-        random.shuffle(items)
-        for item in items:
-            await self.queue.put(item)
-
-    async def remove(self, index: int) -> Optional[PartialYTDLSource]:
-        items: List[PartialYTDLSource] = []
-        removed: Optional[PartialYTDLSource] = None
-        while not self.queue.empty():
-            items.append(await self.queue.get())
-        if 0 <= index < len(items):
-            removed = items.pop(index)
-        for item in items:
-            await self.queue.put(item)
+        self.queue.shuffle()
+
+    async def remove(self, index: int) -> Optional[QueueItem]:
+        removed = self.queue.remove(index)
+        if removed is not None and removed is not self.current:
+            removed.discard()
         return removed
 
+    async def move(self, src: int, dst: int) -> bool:
+        return self.queue.move(src, dst)
+
+    async def insert(self, index: int, track: QueueItem) -> None:
+        self.queue.insert(index, track)
+
 class CacheCleaner:
-    def __init__(self, cache_dir: str, max_cache_size: int) -> None:
-        self.cache_dir = cache_dir
-        self.max_cache_size = max_cache_size
+    def __init__(self, cache: AudioCache, orphan_max_age: float = 3600) -> None:
+        self.cache = cache
+        self.orphan_max_age = orphan_max_age
 
     async def cleanup(self) -> None:
-        removed = 0
-        now = time.time()
-
-        def cleanup_files() -> int:
-            count = 0
-            for fname in os.listdir(self.cache_dir):
-                fpath = os.path.join(self.cache_dir, fname)
-                if os.path.isfile(fpath) and (now - os.path.getmtime(fpath) > 3600):
-                    try:
-                        os.remove(fpath)
-                        count += 1
-                    except Exception as e:
-                        logger.error("Ошибка удаления файла из кэша", extra={"file": fpath, "error": str(e)})
-            return count
-
-        removed += await asyncio.to_thread(cleanup_files)
-
-        def calculate_total_size() -> int:
-            return sum(os.path.getsize(os.path.join(self.cache_dir, f))
-                       for f in os.listdir(self.cache_dir)
-                       if os.path.isfile(os.path.join(self.cache_dir, f)))
-        total_size = await asyncio.to_thread(calculate_total_size)
-        if total_size > self.max_cache_size:
-            def get_files() -> List[Tuple[str, float]]:
-                return sorted(
-                    [(os.path.join(self.cache_dir, f), os.path.getmtime(os.path.join(self.cache_dir, f)))
-                     for f in os.listdir(self.cache_dir)
-                     if os.path.isfile(os.path.join(self.cache_dir, f))],
-                    key=lambda x: x[1]
-                )
-            files = await asyncio.to_thread(get_files)
-            for fpath, _ in files:
-                try:
-                    os.remove(fpath)
-                    removed += 1
-                except Exception as e:
-                    logger.error("Ошибка удаления файла из кэша", extra={"file": fpath, "error": str(e)})
-                total_size -= os.path.getsize(fpath) if os.path.exists(fpath) else 0
-                if total_size <= self.max_cache_size:
-                    break
+        # Вытеснение идёт по индексу (LRU/LFU) без обхода каталога; обход нужен только для брошенных файлов
+        removed = await asyncio.to_thread(self.cache.evict)
+        removed += await asyncio.to_thread(self.cache.remove_orphans, self.orphan_max_age)
         if removed:
             logger.info("Очищено файлов из кэша", extra={"count": removed})
@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Set
+from config import (FFMPEG_BINARY, SAMPLE_RATE, CHANNELS, LOUDNORM_PARAMS, aformat_filter,
+                    post_loudnorm_filters, NORMALIZE_CACHE, NORMALIZE_WORKERS, NORMALIZE_BITRATE, PLAYBACK_VOLUME)
+from audio_cache import AudioCache, audio_cache
+from logging_config import logger
+
+# Поля отчёта первого прохода loudnorm, которые подставляются во второй проход
+MEASURED_FIELDS = ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+
+def normalized_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", key) + ".norm.opus")
+
+def measure_loudness(path: str) -> Dict[str, Any]:
+    """Первый проход loudnorm: измеряет громкость файла, ничего не записывая."""
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-i", path, "-vn",
+           "-af", f"loudnorm={LOUDNORM_PARAMS}:print_format=json", "-f", "null", "-"]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    # Отчёт loudnorm – последний JSON-блок в stderr
+    start = result.stderr.rfind("{")
+    end = result.stderr.rfind("}")
+    if result.returncode != 0 or start < 0 or end < start:
+        raise RuntimeError(f"loudnorm не вернул измерения (код {result.returncode})")
+    return json.loads(result.stderr[start:end + 1])
+
+def render_normalized(path: str, out_path: str, measured: Dict[str, Any], gain: float = PLAYBACK_VOLUME) -> None:
+    """Второй проход: линейная нормализация по измерениям, остальная цепочка фильтров и громкость, запись в Opus 48 кГц.
+
+    Громкость «запекается» в файл, чтобы при воспроизведении Opus копировался без перекодирования.
+    """
+    loudnorm = (f"loudnorm={LOUDNORM_PARAMS}:measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+                f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+                f":offset={measured['target_offset']}:linear=true")
+    chain = ",".join([aformat_filter, loudnorm, *post_loudnorm_filters, f"volume={gain}"])
+    tmp_path = out_path + ".part"
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-y", "-i", path, "-vn", "-af", chain,
+           "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-c:a", "libopus", "-b:a", NORMALIZE_BITRATE,
+           "-f", "opus", tmp_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "ffmpeg завершился с ошибкой")
+    os.replace(tmp_path, out_path)
+
+class Normalizer:
+    """Фоновая нормализация файлов кэша: фильтры выполняются один раз на трек, а не при каждом воспроизведении."""
+    def __init__(self, cache: AudioCache, workers: int = NORMALIZE_WORKERS, enabled: bool = NORMALIZE_CACHE) -> None:
+        self.cache = cache
+        self.enabled = enabled
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="normalize")
+        self.lock = threading.Lock()
+        self.in_progress: Set[str] = set()
+        self.done: int = 0
+        self.failed: int = 0
+
+    def submit(self, key: Optional[str]) -> None:
+        """Ставит запись кэша в очередь на нормализацию; безопасно вызывать из любого потока."""
+        if not self.enabled or not key:
+            return
+        with self.lock:
+            if key in self.in_progress:
+                return
+            self.in_progress.add(key)
+        self.executor.submit(self._normalize, key)
+
+    def _normalize(self, key: str) -> None:
+        try:
+            source = self.cache.get_source(key)
+            if not source or source[1] or not os.path.exists(source[0]):
+                return
+            path = source[0]
+            out_path = normalized_path(self.cache.cache_dir, key)
+            measured = measure_loudness(path)
+            render_normalized(path, out_path, measured)
+            loudnorm = {field: measured.get(field) for field in MEASURED_FIELDS}
+            loudnorm["gain"] = PLAYBACK_VOLUME
+            if self.cache.set_normalized(key, out_path, loudnorm):
+                self.done += 1
+                logger.info("Трек нормализован", extra={"key": key, "input_i": measured.get("input_i")})
+            elif os.path.exists(out_path):
+                os.remove(out_path)  # запись вытеснена, пока шла нормализация
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Ошибка нормализации", extra={"key": key, "error": str(e)})
+        finally:
+            with self.lock:
+                self.in_progress.discard(key)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"pending": len(self.in_progress), "done": self.done, "failed": self.failed}
+
+# Глобальный нормализатор кэша
+normalizer = Normalizer(audio_cache)
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Optional
+from music_queue import MusicQueue, LazyTrack
+from download_scheduler import PRIORITY_NEXT_UP, PRIORITY_PREFETCH
+from config import PREFETCH_DEPTH, PREFETCH_MAX_CONCURRENT, PREFETCH_DISK_BUDGET, PREFETCH_BYTES_PER_SECOND
+from logging_config import logger
+
+class Prefetcher:
+    """Фоновая предзагрузка ближайших треков очереди одного сервера в пределах бюджета диска и полосы."""
+    def __init__(self, queue: MusicQueue, depth: int = PREFETCH_DEPTH, max_concurrent: int = PREFETCH_MAX_CONCURRENT,
+                 disk_budget: int = PREFETCH_DISK_BUDGET) -> None:
+        self.queue = queue
+        self.depth = depth
+        self.max_concurrent = max_concurrent
+        self.disk_budget = disk_budget
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+            self.queue.changed.set()
+
+    def stop(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.queue.changed.wait()
+                self.queue.changed.clear()
+                self.prefetch()
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                # Ошибка одного прохода не должна останавливать предзагрузку сервера до перезагрузки кога
+                logger.error("Ошибка предзагрузки", extra={"error": str(e)})
+
+    def prefetch(self) -> None:
+        in_flight = 0
+        reserved = 0
+        for position, item in enumerate(self.queue.upcoming(self.depth)):
+            if not isinstance(item, LazyTrack):
+                continue
+            size = item.estimated_size(PREFETCH_BYTES_PER_SECOND)
+            if position == 0:
+                item.request.promote(PRIORITY_NEXT_UP)
+            if item.resolve_task is not None:
+                reserved += size
+                if not item.resolve_task.done():
+                    in_flight += 1
+                continue
+            # Первый трек очереди загружается всегда – иначе между треками будет пауза
+            if position > 0 and (in_flight >= self.max_concurrent or reserved + size > self.disk_budget):
+                break
+            item.start_resolving(PRIORITY_NEXT_UP if position == 0 else PRIORITY_PREFETCH)
+            item.resolve_task.add_done_callback(lambda _: self.queue.changed.set())
+            logger.debug("Предзагрузка трека", extra={"title": item.title, "position": position})
+            reserved += size
+            in_flight += 1
@@ -0,0 +1,139 @@
+import time
+import heapq
+import asyncio
+from typing import Dict, List, Set, Tuple, Optional, Callable, Awaitable, Any
+import discord
+from config import (PROGRESS_MIN_INTERVAL, PROGRESS_MAX_INTERVAL, PROGRESS_MAX_EDITS_PER_SECOND, PROGRESS_BAR_LENGTH,
+                    PROGRESS_SLOW_EDIT)
+from logging_config import logger
+
+# Кадр прогресса: сообщение, готовый embed, отрисованный текст (для сравнения) и длительность трека
+ProgressFrame = Tuple[discord.Message, discord.Embed, str, float]
+
+class ProgressScheduler:
+    """Планировщик обновлений прогресса: интервал на сервер, слияние одинаковых правок и отступ при лимитах Discord."""
+    def __init__(self, min_interval: float = PROGRESS_MIN_INTERVAL, max_interval: float = PROGRESS_MAX_INTERVAL,
+                 max_edits_per_second: float = PROGRESS_MAX_EDITS_PER_SECOND,
+                 slow_edit: float = PROGRESS_SLOW_EDIT) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_edits_per_second = max_edits_per_second
+        self.slow_edit = slow_edit
+        self.heap: List[Tuple[float, int]] = []
+        self.due: Dict[int, float] = {}
+        self.active: Set[int] = set()
+        self.last_text: Dict[int, str] = {}
+        self.backoff: Dict[int, float] = {}
+        self.blocked_until: Dict[int, float] = {}
+        self.updating: Dict[int, asyncio.Task] = {}
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.sent: int = 0
+        self.skipped: int = 0
+        self.rate_limited: int = 0
+
+    def interval_for(self, guild_id: int, duration: float) -> float:
+        # Полоса из PROGRESS_BAR_LENGTH делений меняется раз в duration / length секунд – чаще обновлять незачем
+        interval = duration / PROGRESS_BAR_LENGTH if duration else self.max_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        # Запас по лимитам: при большом числе активных серверов растягиваем интервал для всех
+        demand = len(self.active) / interval
+        if demand > self.max_edits_per_second:
+            interval *= demand / self.max_edits_per_second
+        return interval * self.backoff.get(guild_id, 1.0)
+
+    def schedule(self, guild_id: int, delay: float = 0.0) -> None:
+        self.active.add(guild_id)
+        if guild_id in self.updating:
+            return  # правка ещё идёт – задача сама запланирует следующую
+        due = max(time.monotonic() + delay, self.blocked_until.get(guild_id, 0.0))
+        self.due[guild_id] = due
+        heapq.heappush(self.heap, (due, guild_id))
+        self.wakeup.set()
+
+    def cancel(self, guild_id: int) -> None:
+        self.active.discard(guild_id)
+        self.due.pop(guild_id, None)
+        self.last_text.pop(guild_id, None)
+        self.backoff.pop(guild_id, None)
+        self.blocked_until.pop(guild_id, None)
+
+    async def run(self, render: Callable[[int], Awaitable[Optional[ProgressFrame]]]) -> None:
+        try:
+            while True:
+                now = time.monotonic()
+                while self.heap and (self.due.get(self.heap[0][1]) != self.heap[0][0]):
+                    heapq.heappop(self.heap)  # устаревшая запись после перепланирования или отмены
+                if not self.heap:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                due, guild_id = self.heap[0]
+                wait = due - now
+                if wait > 0:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self.heap)
+                del self.due[guild_id]
+                # Правка идёт отдельной задачей: медленный ответ Discord одному серверу не задерживает остальные
+                self.updating[guild_id] = asyncio.create_task(self._update(guild_id, render))
+        finally:
+            for task in self.updating.values():
+                task.cancel()
+
+    async def _update(self, guild_id: int, render: Callable[[int], Awaitable[Optional[ProgressFrame]]]) -> None:
+        try:
+            try:
+                frame = await render(guild_id)
+            except Exception as e:
+                logger.error("Ошибка отрисовки прогресса", extra={"guild": guild_id, "error": str(e)})
+                frame = None
+            if frame is None:
+                # Пауза или нет трека: ничего не отправляем и проверяем реже
+                self.skipped += 1
+                delay = self.max_interval
+            else:
+                message, embed, text, duration = frame
+                await self._publish(guild_id, message, embed, text)
+                delay = self.interval_for(guild_id, duration)
+        finally:
+            self.updating.pop(guild_id, None)
+        if guild_id in self.active:
+            self.schedule(guild_id, delay)
+
+    def _slow_down(self, guild_id: int) -> None:
+        self.rate_limited += 1
+        self.backoff[guild_id] = min(self.backoff.get(guild_id, 1.0) * 2, 8.0)
+
+    async def _publish(self, guild_id: int, message: discord.Message, embed: discord.Embed, text: str) -> None:
+        if self.last_text.get(guild_id) == text:
+            self.skipped += 1
+            return
+        started = time.monotonic()
+        try:
+            await message.edit(embed=embed)
+        except discord.RateLimited as e:
+            # Ожидание дольше max_ratelimit_timeout клиента: discord.py не ждёт сам, а сообщает срок
+            self._slow_down(guild_id)
+            self.blocked_until[guild_id] = time.monotonic() + e.retry_after
+            logger.warning("Лимит Discord на правку прогресса", extra={"guild": guild_id, "retry_after": e.retry_after})
+            return
+        except discord.HTTPException as e:
+            logger.error("Ошибка обновления прогресса", extra={"error": str(e)})
+            return
+        self.sent += 1
+        self.last_text[guild_id] = text
+        # Короткие 429 discord.py повторяет внутри edit() – заметны они только по задержке ответа
+        if time.monotonic() - started > self.slow_edit:
+            self._slow_down(guild_id)
+            logger.debug("Медленная правка прогресса", extra={"guild": guild_id, "seconds": round(time.monotonic() - started, 2)})
+        elif guild_id in self.backoff:
+            self.backoff[guild_id] = max(self.backoff[guild_id] / 2, 1.0)
+            if self.backoff[guild_id] == 1.0:
+                del self.backoff[guild_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"active": len(self.active), "sent": self.sent, "skipped": self.skipped, "rate_limited": self.rate_limited}
@@ -0,0 +1,66 @@
+import asyncio
+from typing import Optional, Dict, Any, List
+from config import SEARCH_RESULTS, SEARCH_CACHE_SIZE, SEARCH_TTL, ytdl_search_options
+from metadata_cache import MetadataCache, normalize_query
+from extraction_pool import extraction_service
+
+def search_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # У плоской записи ссылка на страницу лежит в url, а webpage_url может отсутствовать
+    return dict(entry, webpage_url=entry.get("webpage_url") or entry.get("url"))
+
+class SearchService:
+    """Поиск по тексту через плоское извлечение (только метаданные списка, без форматов каждого видео).
+
+    Одинаковые параллельные запросы объединяются, результаты кэшируются на SEARCH_TTL.
+    """
+    def __init__(self, results: int = SEARCH_RESULTS, cache_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_TTL) -> None:
+        self.results = results
+        self.cache = MetadataCache(cache_size, ttl, ttl)
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.searches: int = 0
+        self.coalesced: int = 0
+
+    async def _extract(self, query: str) -> List[Dict[str, Any]]:
+        self.searches += 1
+        info = await extraction_service.extract(f"ytsearch{self.results}:{query}", ytdl_search_options)
+        entries = [search_entry(e) for e in (info or {}).get("entries") or [] if e and (e.get("url") or e.get("webpage_url"))]
+        self.cache.put(query, {"entries": entries})
+        return entries
+
+    def _shared(self, query: str) -> asyncio.Task:
+        key = normalize_query(query)
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.create_task(self._extract(query))
+        self.in_flight[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return task
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        self.in_flight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # все ожидающие могли быть отменены – не даём asyncio ругаться на ошибку
+
+    def cached(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        info = self.cache.get(query)
+        return info["entries"] if info is not None else None
+
+    async def search(self, query: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        entries = self.cached(query)
+        if entries is None:
+            entries = await asyncio.shield(self._shared(query))
+        return entries[:limit or self.results]
+
+    async def top(self, query: str) -> Optional[Dict[str, Any]]:
+        """Первый результат для !play. Поиск тот же, что у search(): ytsearch1 отдельно не запускается – он грузит
+        ту же первую страницу выдачи и не быстрее, а полный список нужен поиску альтернатив."""
+        entries = await self.search(query, 1)
+        return entries[0] if entries else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.cache.get_stats(), searches=self.searches, coalesced=self.coalesced, in_flight=len(self.in_flight))
+
+# Глобальный сервис поиска
+search_service = SearchService()
@@ -0,0 +1,118 @@
+import random
+import asyncio
+from typing import Optional, Dict, Any
+import discord
+from config import VOICE_CONNECT_TIMEOUT, VOICE_CONNECT_ATTEMPTS, VOICE_BACKOFF_BASE, VOICE_BACKOFF_MAX
+from logging_config import logger
+
+# Состояния голосового соединения сервера
+VOICE_DISCONNECTED = "disconnected"
+VOICE_CONNECTING = "connecting"
+VOICE_CONNECTED = "connected"
+VOICE_CLOSED = "closed"  # отключение по команде: потеря соединения не приводит к переподключению
+
+def backoff_delay(attempt: int, base: float = VOICE_BACKOFF_BASE, cap: float = VOICE_BACKOFF_MAX) -> float:
+    # «Полный разброс»: серверы, потерявшие голос одновременно, не переподключаются синхронно
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def wait_ready(vc: discord.VoiceClient, timeout: float) -> bool:
+    """Ждёт готовности голосового клиента по событию его состояния, без фиксированных пауз."""
+    if vc.is_connected():
+        return True
+    state = getattr(vc, "_connection", None)
+    if state is not None and hasattr(state, "wait_async"):
+        try:
+            await state.wait_async(timeout)
+        except asyncio.TimeoutError:
+            return False
+    return vc.is_connected()
+
+class VoiceConnection:
+    """Голосовое соединение одного сервера: явные состояния, событие готовности и ограниченный отступ."""
+    def __init__(self, guild: discord.Guild) -> None:
+        self.guild = guild
+        self.state: str = VOICE_DISCONNECTED
+        self.ready: asyncio.Event = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.channel_id: Optional[int] = None
+        self.failures: int = 0
+        self.reconnects: int = 0
+
+    @property
+    def voice_client(self) -> Optional[discord.VoiceClient]:
+        return self.guild.voice_client
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.debug("Голосовое соединение", extra={"guild": self.guild.id, "from": self.state, "to": state})
+        self.state = state
+        if state == VOICE_CONNECTED:
+            self.ready.set()
+        else:
+            self.ready.clear()
+
+    async def connect(self, channel: discord.abc.Connectable) -> Optional[discord.VoiceClient]:
+        # Под блокировкой: параллельные вызовы не открывают второе соединение, а получают результат первого
+        async with self.lock:
+            self.channel_id = channel.id
+            for attempt in range(VOICE_CONNECT_ATTEMPTS):
+                vc = self.voice_client
+                try:
+                    if vc and await wait_ready(vc, VOICE_CONNECT_TIMEOUT):
+                        if vc.channel.id != channel.id:
+                            await vc.move_to(channel)
+                        self._set_state(VOICE_CONNECTED)
+                        return vc
+                    self._set_state(VOICE_CONNECTING)
+                    if vc:
+                        await vc.disconnect(force=True)  # клиент так и не восстановился – открываем заново
+                    vc = await channel.connect(timeout=VOICE_CONNECT_TIMEOUT, reconnect=True)
+                    self._set_state(VOICE_CONNECTED)
+                    return vc
+                except Exception as e:
+                    self.failures += 1
+                    delay = backoff_delay(attempt)
+                    logger.error("Ошибка подключения", extra={"attempt": attempt + 1, "delay": round(delay, 2),
+                                                              "error": str(e)})
+                    await asyncio.sleep(delay)
+            self._set_state(VOICE_DISCONNECTED)
+            return None
+
+    async def reconnect(self) -> Optional[discord.VoiceClient]:
+        """Переподключение к последнему каналу после потери соединения."""
+        channel = self.guild.get_channel(self.channel_id) if self.channel_id else None
+        if self.state == VOICE_CLOSED or channel is None:
+            return None
+        self.reconnects += 1
+        self._set_state(VOICE_DISCONNECTED)
+        return await self.connect(channel)
+
+    async def disconnect(self) -> None:
+        self._set_state(VOICE_CLOSED)
+        vc = self.voice_client
+        if vc:
+            await vc.disconnect()
+
+    def lost(self) -> bool:
+        """Соединение потеряно, а не закрыто командой."""
+        vc = self.voice_client
+        return self.state != VOICE_CLOSED and not (vc and vc.is_connected())
+
+class VoiceManager:
+    def __init__(self) -> None:
+        self.connections: Dict[int, VoiceConnection] = {}
+
+    def get(self, guild: discord.Guild) -> VoiceConnection:
+        if guild.id not in self.connections:
+            self.connections[guild.id] = VoiceConnection(guild)
+        return self.connections[guild.id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for connection in self.connections.values():
+            states[connection.state] = states.get(connection.state, 0) + 1
+        return {"states": states, "reconnects": sum(c.reconnects for c in self.connections.values()),
+                "failures": sum(c.failures for c in self.connections.values())}
+
+# Глобальный менеджер голосовых соединений
+voice_manager = VoiceManager()
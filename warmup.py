@@ -0,0 +1,97 @@
+import os
+import time
+import asyncio
+from typing import Callable, Dict, Any, List
+from config import WARMUP_TOP_N, WARMUP_CACHE_FILL, WARMUP_BYTES_PER_SECOND, WARMUP_MAX_PLAYING
+from audio_cache import AudioCache, audio_cache, key_from_url
+from analytics import analytics
+from normalizer import normalizer
+from downloader import PartialDownloader
+from download_scheduler import download_scheduler, DownloadRequest, PRIORITY_BULK
+from logging_config import logger
+
+class CacheWarmer:
+    """Прогрев кэша в часы затишья: самые играемые треки загружаются и нормализуются заранее.
+
+    Кандидаты – рейтинг прослушиваний из статистики и записи кэша с наибольшим числом попаданий.
+    Прогрев идёт с фоновым приоритетом, останавливается при появлении нагрузки, не заполняет кэш
+    выше WARMUP_CACHE_FILL и держит среднюю скорость загрузки не выше WARMUP_BYTES_PER_SECOND.
+    """
+    def __init__(self, cache: AudioCache = audio_cache, top_n: int = WARMUP_TOP_N, fill: float = WARMUP_CACHE_FILL,
+                 bytes_per_second: int = WARMUP_BYTES_PER_SECOND, max_playing: int = WARMUP_MAX_PLAYING) -> None:
+        self.cache = cache
+        self.top_n = top_n
+        self.fill = fill
+        self.bytes_per_second = bytes_per_second
+        self.max_playing = max_playing
+        self.runs: int = 0
+        self.interrupted: int = 0
+        self.warmed: int = 0
+        self.normalize_submitted: int = 0
+        self.bytes: int = 0
+
+    def idle(self, playing: int) -> bool:
+        return playing <= self.max_playing and download_scheduler.active == 0 and not download_scheduler.waiting
+
+    def has_room(self) -> bool:
+        return self.cache.total_size < self.cache.max_cache_size * self.fill
+
+    def _normalize(self, key: str) -> None:
+        if normalizer.enabled:
+            normalizer.submit(key)
+            self.normalize_submitted += 1
+
+    async def _download(self, url: str) -> int:
+        downloader = await PartialDownloader.acquire(url, request=DownloadRequest(PRIORITY_BULK))
+        try:
+            await downloader.task
+        finally:
+            downloader.release()
+        if downloader.failed or not downloader.file_path or not os.path.exists(downloader.file_path):
+            return 0
+        return os.path.getsize(downloader.file_path)
+
+    async def run(self, playing: Callable[[], int]) -> int:
+        """Один проход прогрева; playing – сколько серверов сейчас играют."""
+        self.runs += 1
+        for key, normalized in await asyncio.to_thread(self.cache.most_hit, self.top_n):
+            if not normalized:
+                self._normalize(key)
+        top: List[Dict[str, Any]] = await asyncio.to_thread(analytics.top_tracks, self.top_n)
+        warmed = 0
+        for track in top:
+            if not self.idle(playing()) or not self.has_room():
+                self.interrupted += 1
+                break
+            key = await asyncio.to_thread(key_from_url, track["url"])
+            source = self.cache.get_source(key) if key else None
+            if source:
+                if not source[1]:
+                    self._normalize(key)
+                continue
+            started = time.monotonic()
+            try:
+                size = await self._download(track["url"])
+            except Exception as e:
+                logger.debug("Прогрев трека не удался", extra={"url": track["url"], "error": str(e)})
+                continue
+            if not size:
+                continue
+            self.bytes += size
+            self.warmed += 1
+            warmed += 1
+            logger.debug("Трек прогрет", extra={"title": track["title"], "size": size})
+            # Ограничение полосы: пауза до средней скорости WARMUP_BYTES_PER_SECOND
+            pause = size / self.bytes_per_second - (time.monotonic() - started)
+            if pause > 0:
+                await asyncio.sleep(pause)
+        if warmed:
+            logger.info("Прогрев кэша", extra={"warmed": warmed, "cache_size": self.cache.total_size})
+        return warmed
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"runs": self.runs, "interrupted": self.interrupted, "warmed": self.warmed,
+                "normalize_submitted": self.normalize_submitted, "bytes": self.bytes}
+
+# Глобальный прогрев кэша
+cache_warmer = CacheWarmer()